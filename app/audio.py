@@ -0,0 +1,208 @@
+import json
+import os
+import tempfile
+import time
+from cancellation import run_subprocess
+
+# =============================
+# Adaptive audio preparation
+# =============================
+# Before transcription the input is probed with ffprobe (codec, duration, bitrate)
+# and one of these strategies is chosen:
+#   passthrough -> audio file already accepted by the provider and small enough
+#   copy        -> compatible audio track copied out of the container (no re-encode)
+#   transcode   -> AAC mono 16kHz, bitrate computed to fit the provider's size limit
+#   pcm         -> raw 16kHz PCM piped from ffmpeg straight into a local model (no file)
+
+VIDEO_EXTENSIONS = [".mp4", ".mov", ".mkv", ".avi", ".flv", ".wmv"]
+AUDIO_EXTENSIONS = [".mp3", ".wav", ".m4a", ".aac", ".flac"]
+
+# Codecs the OpenAI API accepts as-is, and the container each one is copied into
+STREAM_COPY_CONTAINERS = {
+    "aac": ".m4a",
+    "mp3": ".mp3",
+    "flac": ".flac",
+    "opus": ".ogg",
+    "vorbis": ".ogg",
+}
+# Extensions the OpenAI API accepts for direct upload
+PROVIDER_ACCEPTED_EXTENSIONS = [".mp3", ".m4a", ".wav", ".flac", ".ogg", ".webm", ".mp4", ".mpeg", ".mpga"]
+
+# Upper and lower bounds for the transcode bitrate (bits/s). 48k mono is the
+# previous fixed setting; below 16k speech recognition quality drops sharply.
+MAX_TRANSCODE_BITRATE = 48000
+MIN_TRANSCODE_BITRATE = 16000
+# Safety margin for container overhead when targeting a size limit
+SIZE_LIMIT_MARGIN = 0.95
+# Rough AAC re-encode speed (seconds of audio per second) used to log the time saved
+AUDIO_REENCODE_SPEED = float(os.getenv("AUDIO_REENCODE_SPEED", "150"))
+WHISPER_SAMPLE_RATE = 16000
+
+
+async def probe_media(path: str) -> dict:
+    """
+    Inspects the first audio stream with ffprobe.
+    Returns codec, duration (s), bit_rate (bits/s) and size (bytes); unknown values are None.
+    """
+    output = await run_subprocess([
+        "ffprobe", "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name,bit_rate,duration:format=duration",
+        "-of", "json",
+        path,
+    ])
+    info = json.loads(output or b"{}")
+    streams = info.get("streams") or [{}]
+    stream = streams[0]
+    media_format = info.get("format", {})
+
+    def number(*values):
+        for value in values:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                continue
+        return None
+
+    return {
+        "codec": stream.get("codec_name"),
+        "has_audio": bool(info.get("streams")),
+        "duration": number(stream.get("duration"), media_format.get("duration")),
+        # Audio stream bitrate only: the format bitrate would include the video track
+        "bit_rate": number(stream.get("bit_rate")),
+        "size": os.path.getsize(path),
+    }
+
+
+def compute_target_bitrate(duration: float, max_bytes: int) -> int:
+    """
+    Highest bitrate (bits/s, capped at MAX_TRANSCODE_BITRATE) that keeps the output under max_bytes.
+    """
+    if not duration or not max_bytes:
+        return MAX_TRANSCODE_BITRATE
+    bitrate = int(max_bytes * 8 * SIZE_LIMIT_MARGIN / duration)
+    if bitrate < MIN_TRANSCODE_BITRATE:
+        print(f"[AUDIO] Audio too long to fit {max_bytes} bytes at {MIN_TRANSCODE_BITRATE} bits/s; upload may be rejected")
+    return max(MIN_TRANSCODE_BITRATE, min(MAX_TRANSCODE_BITRATE, bitrate))
+
+
+def choose_strategy(probe: dict, suffix: str, accepts_pcm: bool, max_upload_bytes: int = None):
+    """
+    Picks how to prepare the audio for a backend. Returns (strategy, detail) where
+    detail is the container extension (copy) or the bitrate in bits/s (transcode).
+    """
+    if accepts_pcm:
+        return "pcm", None
+
+    duration = probe["duration"]
+    is_audio_file = suffix in AUDIO_EXTENSIONS
+    if is_audio_file:
+        estimated_size = probe["size"]
+    elif probe["bit_rate"] and duration:
+        estimated_size = probe["bit_rate"] * duration / 8
+    else:
+        estimated_size = None
+    fits = max_upload_bytes is None or (estimated_size is not None and estimated_size <= max_upload_bytes * SIZE_LIMIT_MARGIN)
+
+    if fits and is_audio_file and suffix in PROVIDER_ACCEPTED_EXTENSIONS:
+        return "passthrough", None
+    if fits and probe["codec"] in STREAM_COPY_CONTAINERS:
+        return "copy", STREAM_COPY_CONTAINERS[probe["codec"]]
+    return "transcode", compute_target_bitrate(duration, max_upload_bytes)
+
+
+async def extract_audio_from_video(video_path, audio_path, bitrate: int = MAX_TRANSCODE_BITRATE):
+    """
+    Extracts audio from a video (or audio) file using ffmpeg.
+    The output is a compressed AAC file (mono, 16kHz) to minimize size for API limits.
+    ffmpeg is killed if the request is cancelled.
+    """
+    command = [
+        "ffmpeg",
+        "-y",
+        "-i", video_path,
+        "-vn",
+        "-acodec", "aac",
+        "-b:a", str(bitrate),
+        "-ac", "1",
+        "-ar", "16000",
+        audio_path,
+    ]
+    await run_subprocess(command)
+
+
+async def copy_audio_stream(input_path, audio_path):
+    """
+    Copies the audio track into its own container without re-encoding.
+    """
+    await run_subprocess(["ffmpeg", "-y", "-i", input_path, "-vn", "-map", "0:a:0", "-acodec", "copy", audio_path])
+
+
+async def decode_to_pcm(input_path):
+    """
+    Decodes the audio to mono 16kHz float32 samples (the format Whisper models take),
+    piped from ffmpeg's stdout without an intermediate file.
+    """
+    import numpy as np
+    raw = await run_subprocess([
+        "ffmpeg", "-nostdin", "-i", input_path,
+        "-vn", "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(WHISPER_SAMPLE_RATE),
+        "-",
+    ])
+    return np.frombuffer(raw, np.int16).astype(np.float32) / 32768.0
+
+
+async def safe_probe_media(path: str) -> dict:
+    """
+    probe_media, but never fails: unknown metadata leads to a plain transcode.
+    """
+    try:
+        return await probe_media(path)
+    except Exception as e:
+        # ffprobe missing or unreadable metadata: fall back to the previous behavior
+        print(f"[AUDIO] ffprobe failed ({e}), transcoding")
+        return {"codec": None, "has_audio": True, "duration": None, "bit_rate": None,
+                "size": os.path.getsize(path)}
+
+
+async def prepare_audio(input_path: str, suffix: str, backend, probe: dict = None):
+    """
+    Probes the input (unless probe is given) and prepares it for the given transcription
+    backend. Returns (audio, temp_path): audio is a file path or a PCM array, temp_path is
+    a file the caller must delete (or None). Logs the decision and the time saved.
+    """
+    start = time.perf_counter()
+    if probe is None:
+        probe = await safe_probe_media(input_path)
+    if not probe["has_audio"]:
+        raise ValueError("No audio stream found")
+
+    strategy, detail = choose_strategy(probe, suffix, backend.accepts_pcm, backend.max_upload_bytes)
+    temp_path = None
+    if strategy == "pcm":
+        audio = await decode_to_pcm(input_path)
+    elif strategy == "passthrough":
+        audio = input_path
+    else:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=detail if strategy == "copy" else ".m4a") as audio_tmp:
+            temp_path = audio_tmp.name
+        try:
+            if strategy == "copy":
+                await copy_audio_stream(input_path, temp_path)
+            else:
+                await extract_audio_from_video(input_path, temp_path, bitrate=detail)
+        except BaseException:
+            # Failed or cancelled: the caller never receives the path, so clean it up here
+            os.remove(temp_path)
+            raise
+        audio = temp_path
+
+    elapsed = time.perf_counter() - start
+    duration = probe["duration"] or 0
+    # Videos used to be always re-encoded to AAC; any other strategy skips that
+    saved = duration / AUDIO_REENCODE_SPEED if strategy != "transcode" and suffix in VIDEO_EXTENSIONS else 0
+    bit_rate = f"{probe['bit_rate'] / 1000:.0f}k" if probe["bit_rate"] else "?"
+    print(f"[AUDIO] {strategy}{f' ({detail})' if detail else ''} for {backend.name}: codec={probe['codec']} "
+          f"duration={duration:.0f}s bitrate={bit_rate} size={probe['size']} bytes; "
+          f"took {elapsed:.2f}s, ~{saved:.1f}s of re-encoding avoided")
+    return audio, temp_path
@@ -0,0 +1,90 @@
+"""
+Benchmark for the self-hosted transcription backends.
+
+Compares real-time factor (transcription time / audio duration, lower is better)
+and peak memory (RSS) of the local openai-whisper model and the faster-whisper
+int8 backend. Each backend runs in its own process so RSS is not shared.
+
+Usage (inside the container, from /app):
+    python benchmark_transcription.py lecture.mp3
+    python benchmark_transcription.py lecture.mp3 --backends faster-whisper --threads 2 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import subprocess
+import time
+
+
+def get_audio_duration(audio_path: str) -> float:
+    """
+    Returns the duration of the audio file in seconds, using ffprobe.
+    """
+    output = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", audio_path],
+        check=True, capture_output=True, text=True,
+    )
+    return float(output.stdout.strip())
+
+
+def run_backend(backend_name: str, audio_path: str, threads: int, results):
+    """
+    Loads one backend and transcribes the file once (runs in a child process).
+    """
+    if threads:
+        # Must be set before transcription.py reads it
+        os.environ["FASTER_WHISPER_CPU_THREADS"] = str(threads)
+    from transcription import transcription_backends
+    backend = transcription_backends[backend_name]
+
+    load_start = time.perf_counter()
+    backend.load()
+    load_time = time.perf_counter() - load_start
+
+    transcribe_start = time.perf_counter()
+    text = backend.transcribe(audio_path)
+    transcribe_time = time.perf_counter() - transcribe_start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put({
+        "load_time": load_time,
+        "transcribe_time": transcribe_time,
+        "peak_rss_mb": peak_rss_mb,
+        "words": len(text.split()),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark self-hosted transcription backends")
+    parser.add_argument("audio_path")
+    parser.add_argument("--backends", nargs="+", default=["local", "faster-whisper"])
+    parser.add_argument("--threads", nargs="+", type=int, default=[0],
+                        help="CPU threads for faster-whisper (0 = FASTER_WHISPER_CPU_THREADS default)")
+    args = parser.parse_args()
+
+    duration = get_audio_duration(args.audio_path)
+    print(f"Audio duration: {duration:.1f} seconds")
+    print(f"{'backend':<16} {'threads':>7} {'load (s)':>9} {'transcribe (s)':>15} {'RTF':>6} {'peak RSS (MB)':>14} {'words':>6}")
+
+    context = multiprocessing.get_context("spawn")
+    for backend_name in args.backends:
+        # Thread count only applies to faster-whisper
+        thread_options = args.threads if backend_name == "faster-whisper" else [0]
+        for threads in thread_options:
+            results = context.Queue()
+            process = context.Process(target=run_backend, args=(backend_name, args.audio_path, threads, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                print(f"{backend_name:<16} failed (exit code {process.exitcode})")
+                continue
+            r = results.get()
+            rtf = r["transcribe_time"] / duration
+            print(f"{backend_name:<16} {threads or '-':>7} {r['load_time']:>9.2f} {r['transcribe_time']:>15.2f} "
+                  f"{rtf:>6.2f} {r['peak_rss_mb']:>14.0f} {r['words']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+from fastapi import APIRouter, HTTPException, Depends
+from pydantic import BaseModel
+from typing import List, Dict
+from utils import verify_token, client, openai_slot
+from state import get_state
+from questions import QuestionRequest, build_questions_messages, parse_questions, QUESTIONS_COMPLETION_PARAMS
+from flashcards import FlashcardRequest, build_flashcards_messages, parse_flashcards, FLASHCARDS_COMPLETION_PARAMS
+import asyncio
+import json
+import os
+import time
+import uuid
+
+# =============================
+# Bulk (offline) generation
+# =============================
+# Large uploads (e.g. a whole semester of lectures) don't need answers in seconds.
+# They are sent through the OpenAI Batch API, which has its own quota, so the
+# real-time rate limit stays free for the interactive endpoints.
+
+router = APIRouter()
+
+# "openai" submits to the Batch API; "local" runs the same JSONL through regular
+# chat completions in-process (stand-in for development and tests)
+BATCH_BACKEND = os.getenv("BATCH_BACKEND", "openai")
+BATCH_COMPLETION_WINDOW = "24h"
+# Batch statuses after which nothing changes anymore (output/error files are final)
+TERMINAL_BATCH_STATUSES = ["completed", "failed", "expired", "cancelled"]
+# Max parallel chat completions used by the local stand-in
+LOCAL_BATCH_CONCURRENCY = int(os.getenv("LOCAL_BATCH_CONCURRENCY", "4"))
+# Max number of transcripts accepted in a single bulk request
+BULK_MAX_TRANSCRIPTS = int(os.getenv("BULK_MAX_TRANSCRIPTS", "500"))
+
+class BulkTranscript(BaseModel):
+    id: str  # Caller-defined identifier, used to fan results back out
+    text: str
+
+class BulkGenerateRequest(BaseModel):
+    transcripts: List[BulkTranscript]
+    kinds: List[str] = ["questions", "flashcards"]  # Which artifacts to generate
+    num_questions: int = 5
+    num_flashcards: int = 10
+
+class BulkJobStatus(BaseModel):
+    job_id: str
+    status: str
+    results: Dict[str, Dict] | None = None  # transcript id -> {kind: output}
+    errors: Dict[str, Dict] | None = None   # transcript id -> {kind: error message}
+
+# Same prompt builders, completion params and parsers as the interactive routers
+BULK_KINDS = {
+    "questions": (
+        lambda text, req: build_questions_messages(QuestionRequest(text=text, num_questions=req.num_questions)),
+        QUESTIONS_COMPLETION_PARAMS,
+        parse_questions,
+    ),
+    "flashcards": (
+        lambda text, req: build_flashcards_messages(FlashcardRequest(text=text, num_flashcards=req.num_flashcards)),
+        FLASHCARDS_COMPLETION_PARAMS,
+        parse_flashcards,
+    ),
+}
+
+# Bulk jobs are kept in the shared state (any worker can answer the polling) for a week
+BULK_JOB_TTL = 7 * 24 * 3600
+
+async def build_batch_jsonl(req: BulkGenerateRequest) -> str:
+    """
+    Builds the Batch API input file: one chat completion request per transcript and kind.
+    The custom_id is '<kind>:<transcript id>' so results can be fanned back out.
+    Transcript preparation and serialization run in worker threads: a bulk request
+    can carry hundreds of long transcripts and must not block the event loop.
+    """
+    requests = []
+    for transcript in req.transcripts:
+        for kind in req.kinds:
+            build_messages, params, _ = BULK_KINDS[kind]
+            requests.append({
+                "custom_id": f"{kind}:{transcript.id}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {**params, "messages": await build_messages(transcript.text, req)},
+            })
+    return await asyncio.to_thread(serialize_batch_jsonl, requests)
+
+def serialize_batch_jsonl(requests: list) -> str:
+    return "\n".join(json.dumps(request, ensure_ascii=False) for request in requests) + "\n"
+
+def fan_out_batch_output(output_jsonl: str):
+    """
+    Parses the Batch API output file and groups the parsed artifacts per transcript.
+    Returns (results, errors), both keyed by transcript id and then by kind.
+    """
+    results = {}
+    errors = {}
+    for line in output_jsonl.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        kind, transcript_id = item["custom_id"].split(":", 1)
+        response = item.get("response") or {}
+        try:
+            if item.get("error") or response.get("status_code") != 200:
+                raise ValueError(item.get("error") or response.get("body"))
+            content = response["body"]["choices"][0]["message"]["content"]
+            _, _, parse = BULK_KINDS[kind]
+            results.setdefault(transcript_id, {})[kind] = parse(content)
+        except Exception as e:
+            print(f"[BULK] Failed to process {item['custom_id']}: {e}")
+            errors.setdefault(transcript_id, {})[kind] = str(getattr(e, "detail", e))
+    return results, errors
+
+# =============================
+# Local Batch API stand-in
+# =============================
+class LocalBatchRunner:
+    """
+    Mimics the subset of the Batch API used here (submit, retrieve status, output file),
+    running each line through a regular chat completion. Batches live in this process
+    only, so use it with a single worker. completion_fn can be replaced
+    (e.g. in tests) by any async callable taking the request body and returning the content.
+    """
+
+    def __init__(self, completion_fn=None, concurrency: int = LOCAL_BATCH_CONCURRENCY):
+        self.completion_fn = completion_fn or self._openai_completion
+        self.concurrency = concurrency
+        self.batches = {}
+        # Running batch tasks, referenced so they are not garbage collected mid-run
+        self._tasks = set()
+
+    async def _openai_completion(self, body: dict) -> str:
+        async with openai_slot():
+            response = await client.chat.completions.create(**body)
+        return response.choices[0].message.content
+
+    async def submit(self, jsonl: str) -> str:
+        batch_id = f"local_batch_{uuid.uuid4().hex}"
+        self.batches[batch_id] = {"status": "in_progress", "output": None}
+        task = asyncio.create_task(self._run(batch_id, jsonl))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return batch_id
+
+    async def _run(self, batch_id: str, jsonl: str):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_line(line):
+            request = json.loads(line)
+            async with semaphore:
+                try:
+                    content = await self.completion_fn(request["body"])
+                    response = {"status_code": 200, "body": {"choices": [{"message": {"content": content}}]}}
+                    error = None
+                except Exception as e:
+                    response = None
+                    error = {"message": str(e)}
+            return json.dumps({"custom_id": request["custom_id"], "response": response, "error": error}, ensure_ascii=False)
+
+        lines = [line for line in jsonl.splitlines() if line.strip()]
+        try:
+            output = await asyncio.gather(*[run_line(line) for line in lines])
+        except Exception as e:
+            print(f"[BULK] Local batch {batch_id} failed: {e}")
+            self.batches[batch_id] = {"status": "failed", "output": ""}
+            return
+        self.batches[batch_id] = {"status": "completed", "output": "\n".join(output) + "\n"}
+
+    async def retrieve(self, batch_id: str):
+        """
+        Returns (status, output_jsonl); output is None until the batch finishes.
+        """
+        batch = self.batches[batch_id]
+        return batch["status"], batch["output"]
+
+local_batch_runner = LocalBatchRunner()
+
+# =============================
+# Batch API helpers
+# =============================
+async def submit_batch(jsonl: str) -> str:
+    """
+    Uploads the JSONL input file and creates the batch. Returns the batch id.
+    """
+    if BATCH_BACKEND == "local":
+        return await local_batch_runner.submit(jsonl)
+    batch_file = await client.files.create(
+        file=("bulk_input.jsonl", jsonl.encode("utf-8")),
+        purpose="batch",
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window=BATCH_COMPLETION_WINDOW,
+    )
+    return batch.id
+
+async def retrieve_batch(batch_id: str):
+    """
+    Polls the batch once. Returns (status, output_jsonl); output is None until the batch
+    reaches a terminal status. Failed, expired and cancelled batches still return whatever
+    lines were processed: successes from the output file, failures from the error file.
+    """
+    if BATCH_BACKEND == "local":
+        return await local_batch_runner.retrieve(batch_id)
+    batch = await client.batches.retrieve(batch_id)
+    if batch.status not in TERMINAL_BATCH_STATUSES:
+        return batch.status, None
+    output = ""
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            content = await client.files.content(file_id)
+            output += content.text
+    return batch.status, output
+
+# =============================
+# Bulk endpoints
+# =============================
+@router.post("/bulk/generate", response_model=BulkJobStatus)
+async def bulk_generate(req: BulkGenerateRequest, user=Depends(verify_token)):
+    """
+    Accepts many transcripts, builds one batch with the same prompts used by
+    /generate_questions and /generate_flashcards and submits it.
+    Poll GET /bulk/{job_id} for the per-transcript results.
+    """
+    if not req.transcripts:
+        raise HTTPException(status_code=400, detail="At least one transcript is required")
+    if len(req.transcripts) > BULK_MAX_TRANSCRIPTS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_TRANSCRIPTS} transcripts per request")
+    unknown_kinds = [kind for kind in req.kinds if kind not in BULK_KINDS]
+    if unknown_kinds or not req.kinds:
+        raise HTTPException(status_code=400, detail=f"Unsupported kinds: {unknown_kinds}")
+    ids = [t.id for t in req.transcripts]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Transcript ids must be unique")
+
+    build_start = time.perf_counter()
+    jsonl = await build_batch_jsonl(req)
+    print(f"[PERF] Bulk batch build ({len(ids)} transcripts) took {time.perf_counter() - build_start:.2f} seconds.")
+    try:
+        batch_id = await submit_batch(jsonl)
+    except Exception as e:
+        print("Error submitting batch:", e)
+        raise HTTPException(status_code=502, detail="Failed to submit batch")
+
+    job_id = uuid.uuid4().hex
+    await get_state().set(f"bulk_job:{job_id}", {
+        "owner": user.get("sub") if isinstance(user, dict) else None,
+        "batch_id": batch_id,
+        "status": "submitted",
+        "results": None,
+        "errors": None,
+    }, ttl=BULK_JOB_TTL)
+    print(f"[BULK] Job {job_id} submitted as batch {batch_id} ({BATCH_BACKEND})")
+    return {"job_id": job_id, "status": "submitted"}
+
+@router.get("/bulk/{job_id}", response_model=BulkJobStatus)
+async def bulk_status(job_id: str, user=Depends(verify_token)):
+    """
+    Polls the underlying batch and, once it is finished (completed, failed, expired or
+    cancelled), returns the results fanned back out per transcript id.
+    """
+    job = await get_state().get(f"bulk_job:{job_id}")
+    owner = user.get("sub") if isinstance(user, dict) else None
+    if not job or job["owner"] != owner:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+
+    if job["results"] is None:
+        try:
+            status, output = await retrieve_batch(job["batch_id"])
+        except Exception as e:
+            print("Error retrieving batch:", e)
+            raise HTTPException(status_code=502, detail="Failed to retrieve batch status")
+        job["status"] = status
+        if output is not None:
+            job["results"], job["errors"] = fan_out_batch_output(output)
+        await get_state().set(f"bulk_job:{job_id}", job, ttl=BULK_JOB_TTL)
+
+    return {"job_id": job_id, "status": job["status"], "results": job["results"], "errors": job["errors"]}
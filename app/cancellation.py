@@ -0,0 +1,201 @@
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+from fastapi import HTTPException, Request
+
+# =============================
+# Request-scoped cancellation
+# =============================
+# Long endpoints (/transcribe, structured study guide) run inside a CancelScope.
+# The scope is cancelled when the client disconnects or the optional deadline
+# passes: the endpoint task is cancelled (which cancels awaited OpenAI calls,
+# gathered tasks and subprocesses) and blocking work running in threads stops at
+# its next check_cancelled() call (e.g. between 30s transcription windows).
+
+# Optional per-request deadline, in seconds from when the request is received
+DEADLINE_HEADER = "X-Request-Timeout"
+# How often the client connection is checked while the endpoint runs
+DISCONNECT_POLL_INTERVAL = 0.5
+# Non-standard status (nginx) for requests closed by the client
+CLIENT_CLOSED_REQUEST = 499
+# How often a worker thread waiting for a model lock checks for cancellation
+LOCK_POLL_INTERVAL = 0.5
+
+_current_scope = contextvars.ContextVar("cancel_scope", default=None)
+
+
+class RequestCancelled(Exception):
+    """
+    Raised inside a cancelled scope (client gone or deadline exceeded).
+    """
+
+
+class CancelScope:
+    """
+    Cancellation state of one request. Safe to read from worker threads.
+    """
+
+    def __init__(self, timeout: float = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+
+    def cancel(self, reason: str):
+        if self.reason is None:
+            self.reason = reason
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    @property
+    def cancelled(self) -> bool:
+        if self.reason is None and self.expired:
+            self.cancel("deadline exceeded")
+        return self.reason is not None
+
+    def remaining(self) -> float | None:
+        """Seconds left before the deadline (None if there is no deadline)."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+
+def current_scope() -> CancelScope | None:
+    return _current_scope.get()
+
+
+def check_cancelled():
+    """
+    Raises RequestCancelled if the current request was cancelled. No-op outside a
+    request scope (e.g. background jobs). Call it at chunk boundaries of blocking work.
+    """
+    scope = current_scope()
+    if scope is not None:
+        scope.check()
+
+
+def remaining_time() -> float | None:
+    """
+    Seconds left before the current request's deadline, usable as a client timeout.
+    """
+    scope = current_scope()
+    return scope.remaining() if scope is not None else None
+
+
+@contextmanager
+def cancellable_lock(lock):
+    """
+    Holds a threading lock, waiting for it from a worker thread in short slices so a
+    cancelled request gives up (RequestCancelled) instead of queueing for the model.
+    """
+    check_cancelled()
+    while not lock.acquire(timeout=LOCK_POLL_INTERVAL):
+        check_cancelled()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def timeout_kwargs() -> dict:
+    """
+    {"timeout": seconds left} for an OpenAI call when the request has a deadline, {}
+    otherwise (an explicit timeout=None would disable the client's default timeout).
+    """
+    remaining = remaining_time()
+    return {"timeout": remaining} if remaining is not None else {}
+
+
+def parse_deadline(request: Request) -> float | None:
+    value = request.headers.get(DEADLINE_HEADER)
+    if value is None:
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {DEADLINE_HEADER} header")
+    if timeout <= 0:
+        raise HTTPException(status_code=400, detail=f"{DEADLINE_HEADER} must be positive")
+    return timeout
+
+
+async def run_cancellable(request: Request, coro):
+    """
+    Runs the endpoint coroutine in a task tied to the request: cancels it when the
+    client disconnects (HTTP 499) or when the X-Request-Timeout deadline passes (HTTP 504).
+    """
+    try:
+        scope = CancelScope(parse_deadline(request))
+    except HTTPException:
+        coro.close()
+        raise
+    token = _current_scope.set(scope)
+    try:
+        # The task copies the current context, so everything it awaits (and
+        # everything run through asyncio.to_thread) sees this scope
+        task = asyncio.create_task(coro)
+    finally:
+        _current_scope.reset(token)
+
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if task.done():
+                break
+            if await request.is_disconnected():
+                scope.cancel("client disconnected")
+            if scope.cancelled:
+                print(f"[CANCEL] Cancelling {request.url.path}: {scope.reason}")
+                task.cancel()
+                break
+        return await task
+    except (asyncio.CancelledError, RequestCancelled):
+        if not task.done():
+            # The endpoint itself was cancelled (e.g. server shutdown)
+            task.cancel()
+        if scope.reason == "deadline exceeded":
+            raise HTTPException(status_code=504, detail="Request deadline exceeded")
+        if scope.reason is not None:
+            raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client closed request")
+        raise
+
+
+async def gather_or_cancel(*aws):
+    """
+    Like asyncio.gather, but cancels the remaining tasks as soon as one fails,
+    instead of letting them run to completion for a result nobody will use.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def run_subprocess(command: list):
+    """
+    Runs a command without blocking the event loop; the process is killed if the
+    calling task is cancelled. Raises RuntimeError on a non-zero exit code.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        print(f"[CANCEL] Killed {command[0]} (pid {process.pid})")
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"{command[0]} failed ({process.returncode}): {stderr.decode(errors='replace')[-500:]}")
+    return stdout
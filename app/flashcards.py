@@ -6,8 +6,11 @@ from pydantic import BaseModel
 from typing import List
 # OpenAI client for GPT-based flashcard generation
 from openai import OpenAI
-from utils import verify_token, client
+from utils import verify_token, client, openai_slot
+from textprep import prepare_transcript
+from speculative import get_precomputed
 import re
+import json
 
 # Create a FastAPI router for flashcard-related endpoints
 router = APIRouter()
@@ -22,9 +25,17 @@ class Flashcard(BaseModel):
     front: str  # The front of the flashcard (question, keyword, or concept)
     back: str   # The back of the flashcard (answer or explanation)
 
-# Endpoint to generate flashcards from input text
-@router.post("/generate_flashcards", response_model=List[Flashcard])
-async def generate_flashcards(req: FlashcardRequest, user=Depends(verify_token)):
+# Completion parameters shared by the interactive endpoint and bulk batches
+FLASHCARDS_COMPLETION_PARAMS = {
+    "model": "gpt-3.5-turbo",
+    "max_tokens": 1800,
+    "temperature": 0.7,
+}
+
+async def build_flashcards_messages(req: FlashcardRequest) -> list:
+    """
+    Builds the chat messages used to generate flashcards.
+    """
     # Prompt instructs the model to generate flashcards in a strict JSON format
     prompt = (
         f"Generate {req.num_flashcards} flashcards from the text below. "
@@ -35,30 +46,48 @@ async def generate_flashcards(req: FlashcardRequest, user=Depends(verify_token))
         "  { \"front\": \"...\", \"back\": \"...\" },\n"
         "  ...\n"
         "]\n"
-        f"Text:\n{req.text}\n"
+        f"Text:\n{await prepare_transcript(req.text)}\n"
     )
+    return [
+        {"role": "system", "content": "You are a helpful assistant that creates flashcards for students."},
+        {"role": "user", "content": prompt},
+    ]
+
+def parse_flashcards(content: str) -> list:
+    """
+    Extracts the JSON array of flashcards from the model output.
+    Raises HTTPException if no JSON is found.
+    """
+    # Use regex to extract the JSON array from the response
+    match = re.search(r'\[.*\]', content, re.DOTALL)
+    if not match:
+        print("Raw model output:", content)
+        raise HTTPException(status_code=500, detail="Model did not return valid JSON")
+    return json.loads(match.group(0))
 
+# Endpoint to generate flashcards from input text
+@router.post("/generate_flashcards", response_model=List[Flashcard])
+async def generate_flashcards(req: FlashcardRequest, user=Depends(verify_token)):
+    # Served instantly if generated in the background after /transcribe?precompute=true
+    precomputed = await get_precomputed("flashcards", req.text, num_flashcards=req.num_flashcards)
+    if precomputed is not None:
+        return precomputed
+    return await create_flashcards(req)
+
+async def create_flashcards(req: FlashcardRequest) -> list:
+    """
+    Generates flashcards with GPT (used by the endpoint and by speculative precomputation).
+    """
     # Call OpenAI GPT model to generate flashcards
-    response = await client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that creates flashcards for students."},
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=1800,
-        temperature=0.7,
-    )
-    import json
+    async with openai_slot():
+        response = await client.chat.completions.create(
+            messages=await build_flashcards_messages(req),
+            **FLASHCARDS_COMPLETION_PARAMS,
+        )
     try:
         # Extract the model's response content
         content = response.choices[0].message.content
-        # Use regex to extract the JSON array from the response
-        match = re.search(r'\[.*\]', content, re.DOTALL)
-        if not match:
-            print("Raw model output:", content)
-            raise HTTPException(status_code=500, detail="Model did not return valid JSON")
-        flashcards = json.loads(match.group(0))
-        return flashcards
+        return parse_flashcards(content)
     except Exception as e:
         print("Error processing flashcards:", e)
         raise HTTPException(status_code=500, detail="Failed to generate flashcards") 
\ No newline at end of file
@@ -3,23 +3,29 @@ from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, HttpUrl
-import shutil
-import subprocess
+import hashlib
 import tempfile
-import whisper
 import os
-from openai import OpenAI
 from transformers import pipeline
 from jose import jwt, JWTError
 from questions import router as questions_router
 from flashcards import router as flashcards_router
-from utils import verify_token, client
+from utils import verify_token, client, openai_slot
 from studyplan import router as studyplan_router
 import time
 from fastapi.responses import StreamingResponse
 import io
 from weasyprint import HTML
 from studyguide import router as studyguide_router
+from state import get_state
+from transcription import get_transcription_backend, available_transcription_backends, run_local_inference
+from cancellation import run_cancellable, check_cancelled, cancellable_lock, timeout_kwargs, RequestCancelled
+from audio import prepare_audio, safe_probe_media, VIDEO_EXTENSIONS, AUDIO_EXTENSIONS
+from routing import router as routing_router, transcription_router, summarization_router
+from speculative import router as speculative_router, schedule_precompute, start_speculative_workers, stop_speculative_workers
+import asyncio
+import threading
+from bulk import router as bulk_router
 
 # =============================
 # FastAPI application instance
@@ -46,14 +52,26 @@ app.add_middleware(
 # Enable GZip compression for responses larger than 1000 bytes
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 
+# =============================
+# Background workers
+# =============================
+# Low-priority workers for speculative precomputation (/transcribe?precompute=true)
+@app.on_event("startup")
+async def start_background_workers():
+    start_speculative_workers()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    stop_speculative_workers()
+
 # ================================
 # External API clients and models
 # ================================
-# OpenAI client for Whisper API and GPT-based summarization
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-# Load the local Whisper model for audio transcription
-model = whisper.load_model("base")
+# OpenAI calls use the shared AsyncOpenAI client from utils.py, awaited in the request
+# task so that cancelling the request aborts them.
+# Transcription models (OpenAI API, local Whisper, faster-whisper) live in transcription.py
+# and are loaded lazily on first use
 
 # ===================================
 # Environment variables and security
@@ -61,6 +79,8 @@ model = whisper.load_model("base")
 DEFAULT_SUMMARY_PROVIDER = os.getenv("DEFAULT_SUMMARY_PROVIDER", "t5")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 NEXTAUTH_SECRET = os.getenv("NEXTAUTH_SECRET", "insecure_dev_secret")
+# How long transcription results are cached (shared state), keyed by file content
+TRANSCRIPTION_CACHE_TTL = int(os.getenv("TRANSCRIPTION_CACHE_TTL", str(24 * 3600)))
 
 # HTTP Bearer authentication for protected endpoints
 security = HTTPBearer()
@@ -88,64 +108,73 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
 # =============================
 # Summarization helper
 # =============================
-# Add global cache for the summarizer
+# Add global cache for the summarizer (the loaded model is per-process by nature)
 summarizer_cache = {}
+# Returned when summarization fails; such results are not cached
+SUMMARY_FAILED = "Summary generation failed."
+# Guards the lazy T5 load so concurrent first requests don't each load a copy
+summarizer_load_lock = threading.Lock()
+# T5 runs one summary at a time (the routing stats model it with concurrency=1)
+summarizer_inference_lock = threading.Lock()
 
-def summarize_text(text: str, provider: str = None) -> str:
+async def summarize_text(text: str, provider: str = None) -> str:
     """
     Summarizes the given text using either OpenAI GPT or local T5 model.
     Truncates text to 5000 characters for performance/safety.
     Loads the T5 model only if needed (provider == 't5').
+    provider == 'auto' picks the backend with the lowest expected completion time.
+    Stops early (RequestCancelled) if the request was cancelled.
     """
     provider = provider or DEFAULT_SUMMARY_PROVIDER
     try:
+        check_cancelled()
         if len(text) > 5000:
             text = text[:5000]
 
-        if provider == "openai" and os.getenv("OPENAI_API_KEY"):
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that summarizes content."},
-                    {"role": "user", "content": f"Summarize the following:\n\n{text}"},
-                ],
-                max_tokens=300,
-                temperature=0.5,
-            )
-            return response.choices[0].message.content.strip()
+        if provider == "auto":
+            provider = summarization_router.choose(len(text), available=["openai", "t5"] if OPENAI_API_KEY else ["t5"])
+        backend = "openai" if provider == "openai" and OPENAI_API_KEY else "t5"
 
-        # Only load T5 summarizer if needed, and cache it
-        if "t5" not in summarizer_cache:
-            from transformers import pipeline
-            summarizer_cache["t5"] = pipeline("summarization", model="t5-small")
-        summarizer = summarizer_cache["t5"]
-        summary = summarizer(text, max_length=150, min_length=40, do_sample=False)
-        return summary[0]["summary_text"]
+        # Latency and errors feed the routing stats, whichever way the backend was chosen
+        if backend == "openai":
+            with summarization_router.track("openai", len(text)) as job:
+                async with openai_slot():
+                    job.start()
+                    response = await client.chat.completions.create(
+                        model="gpt-3.5-turbo",
+                        messages=[
+                            {"role": "system", "content": "You are a helpful assistant that summarizes content."},
+                            {"role": "user", "content": f"Summarize the following:\n\n{text}"},
+                        ],
+                        max_tokens=300,
+                        temperature=0.5,
+                        **timeout_kwargs(),  # Respect the request deadline, if any
+                    )
+            return response.choices[0].message.content.strip()
+        return await run_local_inference(summarize_with_t5, text)
 
+    except RequestCancelled:
+        raise
     except Exception as e:
         print(f"Error during summarization: {e}")
-        return "Summary generation failed."
+        return SUMMARY_FAILED
 
-# =============================
-# Audio extraction helper
-# =============================
-def extract_audio_from_video(video_path, audio_path):
+def summarize_with_t5(text: str) -> str:
     """
-    Extracts audio from a video file using ffmpeg.
-    The output is a compressed AAC file (mono, 16kHz, 48kbps) to minimize size for API limits.
+    Runs the local T5 summarizer (blocking, run it with run_local_inference).
+    Tracked inside the thread: it keeps using the model even if the request is cancelled.
     """
-    command = [
-        "ffmpeg",
-        "-y",
-        "-i", video_path,
-        "-vn",
-        "-acodec", "aac",
-        "-b:a", "48k",
-        "-ac", "1",
-        "-ar", "16000",
-        audio_path,
-    ]
-    subprocess.run(command, check=True)
+    with summarization_router.track("t5", len(text)) as job:
+        # Only load T5 summarizer if needed, and cache it
+        with summarizer_load_lock:
+            if "t5" not in summarizer_cache:
+                from transformers import pipeline
+                summarizer_cache["t5"] = pipeline("summarization", model="t5-small")
+        summarizer = summarizer_cache["t5"]
+        with cancellable_lock(summarizer_inference_lock):
+            job.start()
+            summary = summarizer(text, max_length=150, min_length=40, do_sample=False)
+        return summary[0]["summary_text"]
 
 # =============================
 # Main transcription endpoint
@@ -157,62 +186,100 @@ async def transcribe_audio_or_video(
     user=Depends(verify_token)
 ):
     """
-    Receives an audio or video file via upload, extracts audio if needed,
-    transcribes using OpenAI Whisper API or local Whisper model,
+    Receives an audio or video file via upload, probes it and prepares the audio
+    for the chosen backend (stream copy, size-targeted transcode or raw PCM),
+    transcribes using OpenAI Whisper API, faster-whisper or local Whisper model,
     summarizes the transcription, and returns both.
-    The provider can be set via query string (?provider=openai or ?provider=t5).
+    The provider can be set via query string (?provider=openai, ?provider=faster-whisper or ?provider=t5),
+    or ?provider=auto to route both steps to the least loaded backend.
+    With ?precompute=true, flashcards, questions, study plan and study guide are generated
+    in the background right away and served instantly when requested.
     Logs the time spent in each main operation.
+    Work stops if the client disconnects or the X-Request-Timeout deadline passes.
+    """
+    return await run_cancellable(request, transcribe_pipeline(request, file))
+
+async def transcribe_pipeline(request: Request, file: UploadFile):
+    """
+    Extraction, transcription and summarization steps of /transcribe.
+    OpenAI calls are awaited directly and blocking steps (local models) run in worker
+    threads, so disconnects are noticed meanwhile.
     """
     total_start = time.perf_counter()
     provider = request.query_params.get("provider")  # e.g., ?provider=openai
+    # DEFAULT_SUMMARY_PROVIDER=auto also routes transcription when no provider is given
+    auto_route = (provider or DEFAULT_SUMMARY_PROVIDER) == "auto"
+    precompute = request.query_params.get("precompute", "false").lower() == "true"
     suffix = os.path.splitext(file.filename)[1].lower()
     
     # Save uploaded file to a temporary location
+    # Hash the content while writing it, to look up previous transcriptions of the same file
     upload_start = time.perf_counter()
+    file_hash = hashlib.sha256()
     with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        shutil.copyfileobj(file.file, tmp)
+        for chunk in iter(lambda: file.file.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+            tmp.write(chunk)
         tmp_path = tmp.name
     upload_end = time.perf_counter()
     print(f"[PERF] File save (upload write) took {upload_end - upload_start:.2f} seconds.")
 
+    # Shared cache: a hit from any worker/instance skips extraction, transcription and summary
+    cache_key = f"transcription:{provider or DEFAULT_SUMMARY_PROVIDER}:{file_hash.hexdigest()}"
+    audio_tmp_path = None
     try:
-        # 1) Audio extraction timing
+        cached = await get_state().get(cache_key)
+        if cached is not None:
+            print("[PERF] Transcription cache hit")
+            if precompute:
+                await schedule_precompute(cached["text"])
+            return cached
+
+        if suffix not in VIDEO_EXTENSIONS + AUDIO_EXTENSIONS:
+            raise HTTPException(status_code=400, detail="Unsupported file format")
+
+        # 1) Audio extraction timing (strategy depends on the file and the backend)
         audio_extraction_start = time.perf_counter()
-        if suffix in [".mp4", ".mov", ".mkv", ".avi", ".flv", ".wmv"]:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".m4a") as audio_tmp:
-                extract_audio_from_video(tmp_path, audio_tmp.name)
-                audio_path = audio_tmp.name
-        elif suffix in [".mp3", ".wav", ".m4a", ".aac", ".flac"]:
-            audio_path = tmp_path
+        probe = await safe_probe_media(tmp_path)
+        # Unknown duration: estimate it from the file size (~128 kbps)
+        duration = probe["duration"] or probe["size"] / 16000
+        if auto_route:
+            backend = get_transcription_backend(
+                transcription_router.choose(duration, available=available_transcription_backends())
+            )
         else:
-            raise HTTPException(status_code=400, detail="Unsupported file format")
+            backend = get_transcription_backend(provider)
+        print(f"Using {backend.name} transcription backend")
+        try:
+            audio, audio_tmp_path = await prepare_audio(tmp_path, suffix, backend, probe=probe)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         audio_extraction_end = time.perf_counter()
         print(f"[PERF] Audio extraction took {audio_extraction_end - audio_extraction_start:.2f} seconds.")
 
-        print("Transcribing:", audio_path)
-
         # 2) Transcription timing
         transcription_start = time.perf_counter()
-        if provider == "openai" and OPENAI_API_KEY:
-            print("Using OpenAI Whisper API")
-            text = transcribe_with_openai_whisper(audio_path)
-        else:
-            print("Using local Whisper model")
-            result = model.transcribe(audio_path, language="en")
-            text = result["text"]
+        # Tracked by the backend around the work itself (inside the worker thread for local models)
+        text = await backend.transcribe_async(audio, track=lambda: transcription_router.track(backend.name, duration))
         transcription_end = time.perf_counter()
         print(f"[PERF] Transcription took {transcription_end - transcription_start:.2f} seconds.")
 
         # 3) Summarization timing
         summarization_start = time.perf_counter()
-        summary = summarize_text(text, provider)
+        summary = await summarize_text(text, provider)
         summarization_end = time.perf_counter()
         print(f"[PERF] Summarization took {summarization_end - summarization_start:.2f} seconds.")
 
-        return {
+        result = {
             "text": text,
             "summary": summary
         }
+        # A failed summary (e.g. a transient OpenAI error) must not be served for a whole TTL
+        if summary != SUMMARY_FAILED:
+            await get_state().set(cache_key, result, ttl=TRANSCRIPTION_CACHE_TTL)
+        if precompute:
+            await schedule_precompute(text)
+        return result
 
     finally:
         total_end = time.perf_counter()
@@ -222,31 +289,19 @@ async def transcribe_audio_or_video(
             os.remove(tmp_path)
         except Exception:
             pass
-        if suffix in [".mp4", ".mov", ".mkv", ".avi", ".flv", ".wmv"]:
+        if audio_tmp_path:
             try:
-                os.remove(audio_path)
+                os.remove(audio_tmp_path)
             except Exception:
                 pass
 
 # =============================
-# OpenAI Whisper API helper
-# =============================
-def transcribe_with_openai_whisper(file_path: str) -> str:
-    """
-    Sends the audio file to OpenAI Whisper API for transcription.
-    Returns the transcribed text.
-    """
-    with open(file_path, "rb") as audio_file:
-        response = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file
-        )
-        return response.text
-
-# =============================
-# Routers for additional features (questions, flashcards, study plan)
+# Routers for additional features (questions, flashcards, study plan, bulk, metrics)
 # =============================
 app.include_router(questions_router)
 app.include_router(flashcards_router)
 app.include_router(studyplan_router)
-app.include_router(studyguide_router)
\ No newline at end of file
+app.include_router(studyguide_router)
+app.include_router(bulk_router)
+app.include_router(routing_router)
+app.include_router(speculative_router)
\ No newline at end of file
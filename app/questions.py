@@ -4,9 +4,12 @@ from typing import List
 from openai import OpenAI
 import os
 from jose import jwt, JWTError
-from utils import verify_token, client
+from utils import verify_token, client, openai_slot
+from textprep import prepare_transcript
+from speculative import get_precomputed
 import random
 import re
+import json
 
 # Create a FastAPI router for question-related endpoints
 router = APIRouter()
@@ -23,9 +26,17 @@ class Question(BaseModel):
     correta: int  # Index of the correct alternative
     explicacao: str | None = None  # Optional explanation for the answer
 
-# Endpoint to generate multiple-choice questions from input text
-@router.post("/generate_questions", response_model=List[Question])
-async def generate_questions(req: QuestionRequest, user=Depends(verify_token)):
+# Completion parameters shared by the interactive endpoint and bulk batches
+QUESTIONS_COMPLETION_PARAMS = {
+    "model": "gpt-3.5-turbo",
+    "max_tokens": 1800,
+    "temperature": 0.7,
+}
+
+async def build_questions_messages(req: QuestionRequest) -> list:
+    """
+    Builds the chat messages used to generate multiple-choice questions.
+    """
     # Prompt instructs the model to generate questions in a strict JSON format
     prompt = (
         f"Crie {req.num_questions} questões de múltipla escolha sobre o texto abaixo. "
@@ -38,51 +49,71 @@ async def generate_questions(req: QuestionRequest, user=Depends(verify_token)):
         "  {\"enunciado\":\"...\", \"alternativas\":[\"...\",\"...\",\"...\",\"...\"], \"correta\":0, \"explicacao\":\"...\" },\n"
         "  ...\n"
         "]\n"
-        f"Texto:\n{req.text}\n"
+        f"Texto:\n{await prepare_transcript(req.text)}\n"
     )
+    return [
+        {"role": "system", "content": "Você é um gerador de questões para concursos."},
+        {"role": "user", "content": prompt},
+    ]
+
+def parse_questions(content: str) -> list:
+    """
+    Extracts the JSON array of questions from the model output, cleans up the
+    alternatives and shuffles them. Raises HTTPException if no JSON is found.
+    """
+    # Use regex to extract the JSON array from the response
+    match = re.search(r'\[.*\]', content, re.DOTALL)
+    if not match:
+        print("Raw model output:", content)
+        raise HTTPException(status_code=500, detail="Model did not return valid JSON")
+    questions = json.loads(match.group(0))
+    # Post-process alternatives to ensure no leading numbers or letters from LLM
+    for q in questions:
+        cleaned_alternatives = []
+        for alt in q["alternativas"]:
+            # Remove common prefixes like '1.', 'a)', 'A.', '- ' etc.
+            cleaned_alt = re.sub(r"^[\d]+\.\s*", "", alt).strip()  # 1., 2.
+            cleaned_alt = re.sub(r"^[a-zA-zA-Z][\)\.]\s*", "", cleaned_alt).strip() # a), b), A., B.
+            cleaned_alt = re.sub(r"^[-*]\s*", "", cleaned_alt).strip() # - , * 
+            cleaned_alternatives.append(cleaned_alt)
+        q["alternativas"] = cleaned_alternatives
+
+        # Shuffle alternatives for each question and update the correct index
+        alternatives = q["alternativas"]
+        correct_idx = q["correta"]
+        correct_answer = alternatives[correct_idx]
+        zipped = list(zip(alternatives, range(len(alternatives))))
+        random.shuffle(zipped)
+        shuffled_alts, orig_indices = zip(*zipped)
+        new_correct_idx = shuffled_alts.index(correct_answer)
+        q["alternativas"] = list(shuffled_alts)
+        q["correta"] = new_correct_idx
+    return questions
 
+# Endpoint to generate multiple-choice questions from input text
+@router.post("/generate_questions", response_model=List[Question])
+async def generate_questions(req: QuestionRequest, user=Depends(verify_token)):
+    # Served instantly if generated in the background after /transcribe?precompute=true
+    precomputed = await get_precomputed("questions", req.text, num_questions=req.num_questions)
+    if precomputed is not None:
+        return precomputed
+    return await create_questions(req)
+
+async def create_questions(req: QuestionRequest) -> list:
+    """
+    Generates multiple-choice questions with GPT (used by the endpoint, the study guide
+    and speculative precomputation).
+    """
     # Call OpenAI GPT model to generate questions
-    response = await client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "Você é um gerador de questões para concursos."},
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=1800,
-        temperature=0.7,
-    )
-    import json
+    async with openai_slot():
+        response = await client.chat.completions.create(
+            messages=await build_questions_messages(req),
+            **QUESTIONS_COMPLETION_PARAMS,
+        )
     try:
         # Extract the model's response content
         content = response.choices[0].message.content
-        # Use regex to extract the JSON array from the response
-        match = re.search(r'\[.*\]', content, re.DOTALL)
-        if not match:
-            print("Raw model output:", content)
-            raise HTTPException(status_code=500, detail="Model did not return valid JSON")
-        questions = json.loads(match.group(0))
-        # Post-process alternatives to ensure no leading numbers or letters from LLM
-        for q in questions:
-            cleaned_alternatives = []
-            for alt in q["alternativas"]:
-                # Remove common prefixes like '1.', 'a)', 'A.', '- ' etc.
-                cleaned_alt = re.sub(r"^[\d]+\.\s*", "", alt).strip()  # 1., 2.
-                cleaned_alt = re.sub(r"^[a-zA-zA-Z][\)\.]\s*", "", cleaned_alt).strip() # a), b), A., B.
-                cleaned_alt = re.sub(r"^[-*]\s*", "", cleaned_alt).strip() # - , * 
-                cleaned_alternatives.append(cleaned_alt)
-            q["alternativas"] = cleaned_alternatives
-
-            # Shuffle alternatives for each question and update the correct index
-            alternatives = q["alternativas"]
-            correct_idx = q["correta"]
-            correct_answer = alternatives[correct_idx]
-            zipped = list(zip(alternatives, range(len(alternatives))))
-            random.shuffle(zipped)
-            shuffled_alts, orig_indices = zip(*zipped)
-            new_correct_idx = shuffled_alts.index(correct_answer)
-            q["alternativas"] = list(shuffled_alts)
-            q["correta"] = new_correct_idx
-        return questions
+        return parse_questions(content)
     except Exception as e:
         print("Error processing questions:", e)
         raise HTTPException(status_code=500, detail="Failed to generate questions") 
\ No newline at end of file
@@ -0,0 +1,207 @@
+from fastapi import APIRouter, Depends
+from utils import verify_token, OPENAI_MAX_CONCURRENCY
+from cancellation import RequestCancelled
+from collections import deque
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+# =============================
+# Load-aware provider routing
+# =============================
+# With ?provider=auto (or DEFAULT_SUMMARY_PROVIDER=auto) each job goes to the
+# backend with the lowest expected completion time, estimated from live stats:
+#   expected = seconds_per_unit * size * (1 + in_flight / concurrency) / (1 - error_rate)
+# plus a penalty while a backend is being rate limited (HTTP 429).
+# Size is the audio duration (s) for transcription and characters for summarization.
+# Stats are per process: local models are per process anyway (each runs one job at
+# a time, so concurrency=1), and OpenAI limits are shared through openai_slot().
+
+# Only backends with at least this quality score (0-1) are eligible
+ROUTING_MIN_QUALITY = float(os.getenv("ROUTING_MIN_QUALITY", "0"))
+# Seconds of latency one is willing to pay to save one US dollar (0 = latency only)
+ROUTING_COST_WEIGHT = float(os.getenv("ROUTING_COST_WEIGHT", "0"))
+# Backends excluded from automatic routing, comma-separated (e.g. "local,t5")
+ROUTING_EXCLUDED_BACKENDS = [b.strip() for b in os.getenv("ROUTING_EXCLUDED_BACKENDS", "").split(",") if b.strip()]
+# Weight of the newest observation in the moving averages
+EWMA_ALPHA = 0.2
+# How long a 429 keeps penalizing a backend, and by how much (seconds)
+RATE_LIMIT_COOLDOWN = 60
+RATE_LIMIT_PENALTY = 300
+# Number of recent routing decisions kept for the metrics endpoint
+RECENT_DECISIONS = 50
+
+router = APIRouter()
+
+
+class BackendStats:
+    """
+    Live statistics and static policy data (cost, quality) of one backend.
+    """
+
+    def __init__(self, name: str, seconds_per_unit: float, concurrency: int, cost_per_unit: float, quality: float):
+        self.name = name
+        self.seconds_per_unit = seconds_per_unit  # Prior, then moving average of observed latency
+        self.concurrency = concurrency
+        self.cost_per_unit = cost_per_unit
+        self.quality = quality
+        self.in_flight = 0
+        self.error_rate = 0.0
+        self.completed = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.last_rate_limited_at = None
+        self.routed = 0
+
+    def expected_seconds(self, size: float) -> float:
+        service = self.seconds_per_unit * size
+        queueing = 1 + self.in_flight / self.concurrency
+        expected = service * queueing / max(0.05, 1 - self.error_rate)
+        if self.last_rate_limited_at and time.monotonic() - self.last_rate_limited_at < RATE_LIMIT_COOLDOWN:
+            expected += RATE_LIMIT_PENALTY
+        return expected
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "seconds_per_unit": round(self.seconds_per_unit, 6),
+            "error_rate": round(self.error_rate, 4),
+            "completed": self.completed,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "routed": self.routed,
+            "cost_per_unit": self.cost_per_unit,
+            "quality": self.quality,
+        }
+
+
+class TrackedJob:
+    """
+    Handle yielded by AdaptiveRouter.track(). Call start() once the job got its model
+    lock or API slot, so time spent queueing is not counted as service time.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+
+    def start(self):
+        self.started_at = time.perf_counter()
+
+
+class AdaptiveRouter:
+    """
+    Picks a backend per job and records how each backend performs.
+    Thread-safe: transcription and summarization run in worker threads.
+    """
+
+    def __init__(self, kind: str, unit: str, backends: list):
+        self.kind = kind
+        self.unit = unit
+        self.backends = {b.name: b for b in backends}
+        self.decisions = deque(maxlen=RECENT_DECISIONS)
+        self._lock = threading.Lock()
+
+    def choose(self, size: float, available: list = None) -> str:
+        """
+        Returns the name of the eligible backend with the lowest expected completion
+        time (plus ROUTING_COST_WEIGHT * cost). available restricts the candidates
+        (e.g. backends whose credentials or packages are missing are left out).
+        """
+        with self._lock:
+            candidates = [
+                b for b in self.backends.values()
+                if (available is None or b.name in available)
+                and b.name not in ROUTING_EXCLUDED_BACKENDS
+                and b.quality >= ROUTING_MIN_QUALITY
+            ]
+            if not candidates:
+                # Policies excluded everything: ignore them rather than failing the job
+                candidates = [b for b in self.backends.values() if available is None or b.name in available]
+            if not candidates:
+                candidates = list(self.backends.values())
+            scores = {
+                b.name: b.expected_seconds(size) + ROUTING_COST_WEIGHT * b.cost_per_unit * size
+                for b in candidates
+            }
+            choice = min(scores, key=scores.get)
+            self.backends[choice].routed += 1
+            self.decisions.append({
+                "time": time.time(),
+                "size": size,
+                "choice": choice,
+                "scores": {name: round(score, 3) for name, score in scores.items()},
+            })
+        print(f"[ROUTING] {self.kind}: {choice} for {size:.0f} {self.unit} (scores: {self.decisions[-1]['scores']})")
+        return choice
+
+    @contextmanager
+    def track(self, name: str, size: float):
+        """
+        Wraps one job on a backend: counts it as in flight (queued or running) and
+        updates latency, error rate and 429 stats when it finishes. Must wrap the work
+        itself: for blocking work, enter it inside the worker thread, which keeps running
+        after the request task is cancelled.
+        """
+        stats = self.backends[name]
+        with self._lock:
+            stats.in_flight += 1
+        job = TrackedJob()
+        try:
+            yield job
+        except RequestCancelled:
+            # Cancelled by the client, says nothing about the backend
+            raise
+        except Exception as e:
+            with self._lock:
+                stats.errors += 1
+                stats.error_rate = (1 - EWMA_ALPHA) * stats.error_rate + EWMA_ALPHA
+                if getattr(e, "status_code", None) == 429:
+                    stats.rate_limited += 1
+                    stats.last_rate_limited_at = time.monotonic()
+            raise
+        else:
+            elapsed = time.perf_counter() - job.started_at
+            with self._lock:
+                stats.completed += 1
+                stats.error_rate = (1 - EWMA_ALPHA) * stats.error_rate
+                if size > 0:
+                    stats.seconds_per_unit = (1 - EWMA_ALPHA) * stats.seconds_per_unit + EWMA_ALPHA * elapsed / size
+        finally:
+            with self._lock:
+                stats.in_flight -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "unit": self.unit,
+                "backends": {name: b.snapshot() for name, b in self.backends.items()},
+                "recent_decisions": list(self.decisions),
+            }
+
+
+# Priors are rough CPU / API figures; they converge to observed values after a few jobs.
+# Costs in US dollars per unit (whisper-1: $0.006/min; gpt-3.5-turbo: ~$0.0005 per 1k tokens ~ 4k chars).
+transcription_router = AdaptiveRouter("transcription", "audio seconds", [
+    BackendStats("openai", seconds_per_unit=0.05, concurrency=OPENAI_MAX_CONCURRENCY,
+                 cost_per_unit=0.0001, quality=1.0),
+    BackendStats("faster-whisper", seconds_per_unit=0.5, concurrency=1, cost_per_unit=0, quality=0.9),
+    BackendStats("local", seconds_per_unit=2.0, concurrency=1, cost_per_unit=0, quality=0.9),
+])
+
+summarization_router = AdaptiveRouter("summarization", "characters", [
+    BackendStats("openai", seconds_per_unit=0.0005, concurrency=OPENAI_MAX_CONCURRENCY,
+                 cost_per_unit=0.000000125, quality=1.0),
+    BackendStats("t5", seconds_per_unit=0.001, concurrency=1, cost_per_unit=0, quality=0.5),
+])
+
+
+@router.get("/metrics/routing")
+async def routing_metrics(user=Depends(verify_token)):
+    """
+    Live backend stats and recent routing decisions, for tuning the routing policies.
+    """
+    return {
+        "transcription": transcription_router.snapshot(),
+        "summarization": summarization_router.snapshot(),
+    }
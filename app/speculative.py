@@ -0,0 +1,217 @@
+from fastapi import APIRouter, Depends
+from utils import verify_token, background_priority
+from state import get_state
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+# =============================
+# Speculative precomputation
+# =============================
+# Almost every user who transcribes a file then asks for flashcards, questions,
+# a study plan and the study guide. With /transcribe?precompute=true those are
+# generated in the background right after transcription, with the default
+# parameters, and served instantly when the user asks for them.
+# Jobs go through the shared job queue and are run by a few low-priority workers
+# per process; an hourly budget caps how many jobs can be scheduled, and their
+# OpenAI calls are capped at BACKGROUND_OPENAI_CONCURRENCY (see utils.openai_slot).
+# Each artifact is served once: asking again generates a fresh one.
+
+# Background workers per process (each runs one job at a time)
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "1"))
+# Max speculative jobs scheduled per hour, across all workers sharing the state backend
+SPECULATIVE_MAX_JOBS_PER_HOUR = int(os.getenv("SPECULATIVE_MAX_JOBS_PER_HOUR", "200"))
+# How long precomputed artifacts are kept (seconds)
+SPECULATIVE_TTL = int(os.getenv("SPECULATIVE_TTL", "3600"))
+# How long a request waits for a speculative job that is already running, instead of
+# paying for the same generation twice (seconds)
+SPECULATIVE_WAIT_SECONDS = float(os.getenv("SPECULATIVE_WAIT_SECONDS", "30"))
+# A running job is assumed dead (worker crashed) after this many seconds
+SPECULATIVE_RUNNING_TTL = 300
+SPECULATIVE_POLL_INTERVAL = 0.5
+SPECULATIVE_QUEUE = "speculative"
+
+# Artifacts generated per transcript, with the default parameters of each endpoint
+SPECULATIVE_JOBS = {
+    "flashcards": {"num_flashcards": 10},
+    "questions": {"num_questions": 5},
+    "studyplan": {"num_reviews": 3},
+    "study_guide": {"num_topics": 5, "num_questions": 5},
+}
+# hits/misses only count first lookups of default-parameter artifacts; repeats (artifact
+# already served) and non_default (other parameters, never precomputed) are separate
+METRIC_NAMES = [
+    "scheduled", "skipped_budget", "completed", "failed", "skipped_claimed",
+    "hits", "waited_hits", "misses", "repeats", "non_default",
+]
+
+router = APIRouter()
+
+
+def transcript_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _artifact_key(kind: str, text_hash: str, params: dict) -> str:
+    return f"speculative:{kind}:{text_hash}:{json.dumps(params, sort_keys=True)}"
+
+
+def _marker_key(marker: str, artifact_key: str) -> str:
+    # marker is "running" (job in progress), "claimed" (an endpoint generated it
+    # itself, so the queued job is skipped) or "served" (artifact already consumed)
+    return f"speculative:{marker}:{artifact_key}"
+
+
+async def _count(metric: str, amount: int = 1):
+    await get_state().incr(f"speculative:metrics:{metric}", amount)
+
+
+async def schedule_precompute(text: str):
+    """
+    Queues background generation of every artifact in SPECULATIVE_JOBS for this
+    transcript. Skipped if already scheduled or if the hourly budget is spent.
+    """
+    if not text or not text.strip():
+        return
+    state = get_state()
+    text_hash = transcript_hash(text)
+    if await state.get(f"speculative:scheduled:{text_hash}"):
+        return
+    hour = int(time.time() // 3600)
+    used = await state.incr(f"speculative:budget:{hour}", len(SPECULATIVE_JOBS), ttl=3600)
+    if used > SPECULATIVE_MAX_JOBS_PER_HOUR:
+        print(f"[SPECULATIVE] Budget of {SPECULATIVE_MAX_JOBS_PER_HOUR} jobs/hour reached, skipping")
+        await _count("skipped_budget", len(SPECULATIVE_JOBS))
+        return
+    # Marks the transcript so lookups know speculation was attempted (for hit-rate metrics)
+    await state.set(f"speculative:scheduled:{text_hash}", True, ttl=SPECULATIVE_TTL)
+    for kind, params in SPECULATIVE_JOBS.items():
+        await state.enqueue(SPECULATIVE_QUEUE, {"kind": kind, "text": text, "params": params})
+    await _count("scheduled", len(SPECULATIVE_JOBS))
+    print(f"[SPECULATIVE] Scheduled {len(SPECULATIVE_JOBS)} jobs for transcript {text_hash[:12]}")
+
+
+async def get_precomputed(kind: str, text: str, **params):
+    """
+    Returns the precomputed artifact for this transcript and parameters, or None.
+    The artifact is consumed atomically: a repeated request gets a freshly generated one.
+    If its job is running, waits up to SPECULATIVE_WAIT_SECONDS for it; on a miss the
+    queued job is cancelled, since the endpoint generates the artifact itself.
+    """
+    state = get_state()
+    text_hash = transcript_hash(text)
+    if not await state.get(f"speculative:scheduled:{text_hash}"):
+        return None
+    if params != SPECULATIVE_JOBS.get(kind):
+        await _count("non_default")
+        return None
+    key = _artifact_key(kind, text_hash, params)
+    result = await state.pop(key)
+    waited = False
+    if result is None and await state.get(_marker_key("running", key)):
+        waited = True
+        deadline = time.monotonic() + SPECULATIVE_WAIT_SECONDS
+        while result is None and time.monotonic() < deadline:
+            await asyncio.sleep(SPECULATIVE_POLL_INTERVAL)
+            result = await state.pop(key)
+            if result is None and not await state.get(_marker_key("running", key)):
+                # Finished (possibly failed) between the two reads
+                result = await state.pop(key)
+                break
+    if result is None:
+        if await state.get(_marker_key("served", key)):
+            await _count("repeats")
+        else:
+            await state.set(_marker_key("claimed", key), True, ttl=SPECULATIVE_TTL)
+            await _count("misses")
+        return None
+    await state.set(_marker_key("served", key), True, ttl=SPECULATIVE_TTL)
+    await _count("waited_hits" if waited else "hits")
+    print(f"[SPECULATIVE] Serving precomputed {kind} for transcript {text_hash[:12]}")
+    return result
+
+
+async def run_speculative_job(job: dict):
+    """
+    Generates one artifact with the same code the endpoints use and stores it.
+    Returns False if the job was skipped because an endpoint already generated it.
+    """
+    # Imported here: the routers import get_precomputed from this module
+    from flashcards import FlashcardRequest, create_flashcards
+    from questions import QuestionRequest, create_questions
+    from studyplan import StudyPlanRequest, create_studyplan
+    from studyguide import GenerateStructuredGuideRequest, build_structured_study_guide
+
+    kind, text, params = job["kind"], job["text"], job["params"]
+    state = get_state()
+    key = _artifact_key(kind, transcript_hash(text), params)
+    if await state.get(_marker_key("claimed", key)):
+        return False
+    await state.set(_marker_key("running", key), True, ttl=SPECULATIVE_RUNNING_TTL)
+    start = time.perf_counter()
+    try:
+        if kind == "flashcards":
+            result = await create_flashcards(FlashcardRequest(text=text, **params))
+        elif kind == "questions":
+            result = await create_questions(QuestionRequest(text=text, **params))
+        elif kind == "studyplan":
+            result = await create_studyplan(StudyPlanRequest(text=text, **params))
+        elif kind == "study_guide":
+            result = await build_structured_study_guide(GenerateStructuredGuideRequest(transcript=text, **params), None)
+        else:
+            raise ValueError(f"Unknown speculative job kind: {kind}")
+        await state.set(key, result, ttl=SPECULATIVE_TTL)
+    finally:
+        await state.delete(_marker_key("running", key))
+    print(f"[PERF] Speculative {kind} took {time.perf_counter() - start:.2f} seconds.")
+    return True
+
+
+async def speculative_worker(worker_id: int):
+    """
+    Background loop: takes jobs from the shared queue one at a time.
+    """
+    # Local to this task: its OpenAI calls go through the background limit
+    background_priority.set(True)
+    state = get_state()
+    while True:
+        job = await state.dequeue(SPECULATIVE_QUEUE, timeout=5)
+        if job is None:
+            continue
+        try:
+            await _count("completed" if await run_speculative_job(job) else "skipped_claimed")
+        except Exception as e:
+            print(f"[SPECULATIVE] Worker {worker_id} failed on {job.get('kind')}: {e}")
+            await _count("failed")
+
+
+# Running worker tasks of this process
+speculative_tasks = []
+
+def start_speculative_workers():
+    for worker_id in range(SPECULATIVE_WORKERS):
+        speculative_tasks.append(asyncio.create_task(speculative_worker(worker_id)))
+
+
+def stop_speculative_workers():
+    for task in speculative_tasks:
+        task.cancel()
+    speculative_tasks.clear()
+
+
+@router.get("/metrics/speculative")
+async def speculative_metrics(user=Depends(verify_token)):
+    """
+    Counters for tuning speculation: hit rate is (hits + waited_hits) / (that + misses),
+    and completed - hits - waited_hits approximates the work spent on artifacts nobody
+    asked for.
+    """
+    state = get_state()
+    metrics = {name: await state.get(f"speculative:metrics:{name}") or 0 for name in METRIC_NAMES}
+    served = metrics["hits"] + metrics["waited_hits"]
+    lookups = served + metrics["misses"]
+    metrics["hit_rate"] = round(served / lookups, 4) if lookups else None
+    metrics["budget_per_hour"] = SPECULATIVE_MAX_JOBS_PER_HOUR
+    return metrics
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+
+# =============================
+# Shared state backend
+# =============================
+# Caches, concurrency limits and job queues go through this module instead of
+# module-level globals, so they can be shared by every uvicorn worker and Cloud
+# Run instance when STATE_BACKEND=redis. Values must be JSON-serializable.
+# Loaded models (Whisper, T5) are not state: they stay per-process.
+
+# "memory" (single process, default) or "redis"
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Prefix for every key written to Redis, so the instance can be shared
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "videotonotes:")
+# A semaphore slot not released within this time (e.g. crashed worker) is reclaimed
+SEMAPHORE_LEASE_SECONDS = int(os.getenv("SEMAPHORE_LEASE_SECONDS", "300"))
+# Memory backend: max keys kept (least recently used are evicted first) and how
+# often keys that expired without being read again are swept (seconds)
+MEMORY_STATE_MAX_KEYS = int(os.getenv("MEMORY_STATE_MAX_KEYS", "1000"))
+MEMORY_STATE_SWEEP_INTERVAL = 60
+
+
+class InMemoryState:
+    """
+    Process-local implementation: plain dicts, asyncio semaphores and queues.
+    Bounded like a cache: expired keys are swept periodically and the least recently
+    used keys are evicted beyond max_keys.
+    """
+
+    def __init__(self, max_keys: int = MEMORY_STATE_MAX_KEYS):
+        self._values = OrderedDict()  # key -> (value, expires_at or None), oldest use first
+        self._semaphores = {}
+        self._queues = defaultdict(asyncio.Queue)
+        self.max_keys = max_keys
+        self._last_sweep = time.time()
+
+    def _alive(self, key):
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self._values[key]
+            return None
+        self._values.move_to_end(key)
+        return item
+
+    def _store(self, key, item):
+        self._values[key] = item
+        self._values.move_to_end(key)
+        now = time.time()
+        if now - self._last_sweep >= MEMORY_STATE_SWEEP_INTERVAL:
+            self._last_sweep = now
+            for expired in [k for k, (_, expires_at) in self._values.items() if expires_at is not None and expires_at <= now]:
+                del self._values[expired]
+        while len(self._values) > self.max_keys:
+            self._values.popitem(last=False)
+
+    async def get(self, key: str):
+        item = self._alive(key)
+        return item[0] if item else None
+
+    async def set(self, key: str, value, ttl: int = None):
+        # Round-trip through JSON so both backends accept and return the same values
+        self._store(key, (json.loads(json.dumps(value)), time.time() + ttl if ttl else None))
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def pop(self, key: str):
+        """Returns the value and deletes the key in one step (None if missing)."""
+        item = self._alive(key)
+        if item is None:
+            return None
+        del self._values[key]
+        return item[0]
+
+    async def incr(self, key: str, amount: int = 1, ttl: int = None) -> int:
+        item = self._alive(key)
+        if item is None:
+            value, expires_at = 0, time.time() + ttl if ttl else None
+        else:
+            value, expires_at = item
+        self._store(key, (value + amount, expires_at))
+        return value + amount
+
+    def semaphore(self, name: str, limit: int):
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(limit)
+        return self._semaphores[name]
+
+    async def enqueue(self, queue: str, item):
+        await self._queues[queue].put(json.loads(json.dumps(item)))
+
+    async def dequeue(self, queue: str, timeout: float = None):
+        """
+        Pops the oldest item, waiting up to timeout seconds (forever if None).
+        Returns None on timeout.
+        """
+        try:
+            return await asyncio.wait_for(self._queues[queue].get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+# Acquire a slot only if fewer than ARGV[3] unexpired holders exist (atomic in Redis)
+_ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[2]))
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+class RedisSemaphore:
+    """
+    Distributed counting semaphore: holders are members of a sorted set scored by
+    acquisition time, so slots of crashed workers expire after the lease time.
+    """
+
+    def __init__(self, redis, key: str, limit: int, lease_seconds: int = SEMAPHORE_LEASE_SECONDS,
+                 poll_interval: float = 0.05):
+        self.redis = redis
+        self.key = key
+        self.limit = limit
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._tokens = []
+
+    async def acquire(self):
+        token = uuid.uuid4().hex
+        while True:
+            acquired = await self.redis.eval(
+                _ACQUIRE_SCRIPT, 1, self.key, time.time(), self.lease_seconds, self.limit, token
+            )
+            if int(acquired):
+                self._tokens.append(token)
+                return token
+            await asyncio.sleep(self.poll_interval)
+
+    async def release(self, token: str = None):
+        token = token or self._tokens.pop()
+        if token in self._tokens:
+            self._tokens.remove(token)
+        await self.redis.zrem(self.key, token)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+
+class RedisState:
+    """
+    Redis implementation, shared by all workers/instances.
+    Accepts an existing client (e.g. fakeredis.aioredis.FakeRedis() in tests).
+    """
+
+    def __init__(self, url: str = REDIS_URL, redis=None, prefix: str = STATE_KEY_PREFIX):
+        if redis is None:
+            try:
+                import redis.asyncio as redis_asyncio
+            except ImportError:
+                raise ImportError("redis is not installed. Please install it with 'pip install redis' to use STATE_BACKEND=redis.")
+            redis = redis_asyncio.from_url(url, decode_responses=True)
+        self.redis = redis
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def get(self, key: str):
+        raw = await self.redis.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value, ttl: int = None):
+        await self.redis.set(self._key(key), json.dumps(value), ex=ttl)
+
+    async def delete(self, key: str):
+        await self.redis.delete(self._key(key))
+
+    async def pop(self, key: str):
+        """Returns the value and deletes the key atomically (GETDEL, Redis 6.2+)."""
+        raw = await self.redis.getdel(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def incr(self, key: str, amount: int = 1, ttl: int = None) -> int:
+        value = await self.redis.incrby(self._key(key), amount)
+        if ttl and value == amount:
+            # First increment created the key: start its expiration window
+            await self.redis.expire(self._key(key), ttl)
+        return value
+
+    def semaphore(self, name: str, limit: int):
+        # A fresh object per use: holders are tracked in Redis, not in the object
+        return RedisSemaphore(self.redis, self._key(f"semaphore:{name}"), limit)
+
+    async def enqueue(self, queue: str, item):
+        await self.redis.lpush(self._key(f"queue:{queue}"), json.dumps(item))
+
+    async def dequeue(self, queue: str, timeout: float = None):
+        """
+        Pops the oldest item, waiting up to timeout seconds (forever if None).
+        Returns None on timeout.
+        """
+        result = await self.redis.brpop(self._key(f"queue:{queue}"), timeout=timeout or 0)
+        if result is None:
+            return None
+        return json.loads(result[1])
+
+
+# Backend instance for this process, created on first use
+_state_cache = {}
+
+def get_state():
+    """
+    Returns the configured state backend (STATE_BACKEND=memory or redis).
+    """
+    if "backend" not in _state_cache:
+        if STATE_BACKEND == "redis":
+            _state_cache["backend"] = RedisState(REDIS_URL)
+        elif STATE_BACKEND == "memory":
+            _state_cache["backend"] = InMemoryState()
+        else:
+            raise ValueError(f"Unknown STATE_BACKEND: {STATE_BACKEND}")
+        print(f"Using {STATE_BACKEND} state backend")
+    return _state_cache["backend"]
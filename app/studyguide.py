@@ -1,7 +1,7 @@
-from fastapi import APIRouter, HTTPException, Depends, Body, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, Body, BackgroundTasks, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from utils import verify_token, client
+from utils import verify_token, client, openai_slot
 import io
 from weasyprint import HTML
 import os
@@ -9,7 +9,10 @@ import re
 from typing import List, Dict
 import asyncio
 import httpx
-from questions import QuestionRequest, generate_questions
+from questions import QuestionRequest, create_questions
+from textprep import prepare_transcript
+from cancellation import run_cancellable, gather_or_cancel
+from speculative import get_precomputed
 
 router = APIRouter()
 
@@ -51,18 +54,20 @@ async def segment_topics(data: SegmentTopicsRequest, user=Depends(verify_token))
         "Para cada tópico, retorne apenas o título e o texto do tópico, sem perguntas, sem sumário, sem introdução ou conclusão geral. "
         "Responda SOMENTE com um array JSON, no formato: [ { 'title': '...', 'content': '...' }, ... ]. "
         "Não adicione explicações, comentários ou qualquer texto fora do JSON.\n"
-        f"Texto:\n{data.transcript}"
+        # Normalization only (max_tokens=0): this prompt must keep the whole text
+        f"Texto:\n{await prepare_transcript(data.transcript, max_tokens=0)}"
     )
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Você é um assistente que segmenta textos em tópicos didáticos."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=2000,
-            temperature=0.5,
-        )
+        async with openai_slot():
+            response = await client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "Você é um assistente que segmenta textos em tópicos didáticos."},
+                    {"role": "user", "content": prompt},
+                ],
+                max_tokens=2000,
+                temperature=0.5,
+            )
         import json
         content = response.choices[0].message.content
         # Extract JSON array from the response
@@ -114,6 +119,7 @@ def segment_transcript_semantic_spacy(text: str, min_words: int = 100) -> list:
 
 @router.post("/generate_structured_study_guide", response_model=List[TopicWithQuiz])
 async def generate_structured_study_guide(
+    request: Request,
     data: GenerateStructuredGuideRequest,
     user=Depends(verify_token)
 ):
@@ -122,9 +128,32 @@ async def generate_structured_study_guide(
     - Segments the transcript into semantic blocks
     - For each block, generates a title (ChatGPT) and a quiz (ChatGPT, in parallel)
     - Returns a list of topics, each with its text and quiz.
+    Pending GPT calls are cancelled if the client disconnects or the X-Request-Timeout deadline passes.
+    """
+    return await run_cancellable(request, get_or_build_structured_study_guide(data, user))
+
+async def get_or_build_structured_study_guide(data: GenerateStructuredGuideRequest, user) -> list:
+    """
+    Returns the guide precomputed after /transcribe?precompute=true, or builds it.
+    """
+    precomputed = await get_precomputed(
+        "study_guide", data.transcript, num_topics=data.num_topics, num_questions=data.num_questions
+    )
+    if precomputed is not None:
+        return precomputed
+    return await build_structured_study_guide(data, user)
+
+async def build_structured_study_guide(data: GenerateStructuredGuideRequest, user) -> list:
+    """
+    Builds the structured study guide (topics + quizzes) used by both study guide endpoints.
     """
     # 1. Segment transcript into semantic blocks
-    blocks = segment_transcript_semantic_spacy(data.transcript, min_words=max(80, int(len(data.transcript.split()) / data.num_topics)))
+    # Normalize first (no sentence selection, the guide must cover the whole transcript)
+    transcript = await prepare_transcript(data.transcript, max_tokens=0)
+    # spaCy is CPU-bound: run it in a worker thread so other requests (and background jobs) keep flowing
+    blocks = await asyncio.to_thread(
+        segment_transcript_semantic_spacy, transcript, min_words=max(80, int(len(transcript.split()) / data.num_topics))
+    )
 
     # Helper async function to formalize a single block
     async def formalize_block_async(block):
@@ -133,15 +162,16 @@ async def generate_structured_study_guide(
             f"Texto:\n{block['content']}"
         )
         try:
-            response = await client.chat.completions.create(  # Await the LLM call
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Você é um assistente que reescreve textos para apostilas de estudo."},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=1200,
-                temperature=0.4,
-            )
+            async with openai_slot():
+                response = await client.chat.completions.create(  # Await the LLM call
+                    model="gpt-3.5-turbo",
+                    messages=[
+                        {"role": "system", "content": "Você é um assistente que reescreve textos para apostilas de estudo."},
+                        {"role": "user", "content": prompt},
+                    ],
+                    max_tokens=1200,
+                    temperature=0.4,
+                )
             formal_text = response.choices[0].message.content.strip()
         except Exception as e:
             print(f"[ERROR] Error formalizing block: {e}")
@@ -149,7 +179,7 @@ async def generate_structured_study_guide(
         return {'content': formal_text}
 
     # 1.5. Formalize each block using LLM (ChatGPT) in parallel
-    formalized_blocks = await asyncio.gather(*[formalize_block_async(block) for block in blocks])
+    formalized_blocks = await gather_or_cancel(*[formalize_block_async(block) for block in blocks])
 
     # 2. For each block, generate a title (ChatGPT) and a quiz (in parallel)
     async def get_title_and_quiz_for_block(block):
@@ -160,15 +190,16 @@ async def generate_structured_study_guide(
             f"Texto:\n{block['content']}"
         )
         try:
-            response = await client.chat.completions.create( # Await the LLM call
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Você é um assistente que sugere títulos didáticos para blocos de texto."},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=30,
-                temperature=0.3,
-            )
+            async with openai_slot():
+                response = await client.chat.completions.create( # Await the LLM call
+                    model="gpt-3.5-turbo",
+                    messages=[
+                        {"role": "system", "content": "Você é um assistente que sugere títulos didáticos para blocos de texto."},
+                        {"role": "user", "content": prompt},
+                    ],
+                    max_tokens=30,
+                    temperature=0.3,
+                )
             title = response.choices[0].message.content.strip().replace('"', '').replace("'", "")
         except Exception as e:
             print("Error generating title:", e)
@@ -178,16 +209,16 @@ async def generate_structured_study_guide(
             "text": block['content'],
             "num_questions": data.num_questions
         }
-        # Call the generate_questions function directly instead of making an HTTP request
+        # Call the question generation directly instead of making an HTTP request
         question_request = QuestionRequest(**quiz_req)
-        quiz = await generate_questions(question_request, user)
+        quiz = await create_questions(question_request)
         return {
             "title": title,
             "content": block['content'],
             "quiz": quiz
         }
 
-    results = await asyncio.gather(*[get_title_and_quiz_for_block(block) for block in formalized_blocks])
+    results = await gather_or_cancel(*[get_title_and_quiz_for_block(block) for block in formalized_blocks])
     # Log each topic for debugging: title, first 100 chars of content, content length, quiz count
     for idx, topic in enumerate(results):
         print(f"[DEBUG] Topic {idx+1} - Title: {topic['title']}")
@@ -198,6 +229,7 @@ async def generate_structured_study_guide(
 
 @router.post("/generate_structured_study_guide_pdf")
 async def generate_structured_study_guide_pdf(
+    request: Request,
     data: GenerateStructuredGuideRequest = Body(...),
     title: str = "Study Guide",
     user=Depends(verify_token)
@@ -208,14 +240,18 @@ async def generate_structured_study_guide_pdf(
     - Generates quizzes for each topic
     - Builds the HTML
     - Returns the PDF as a downloadable file
+    Work stops if the client disconnects or the X-Request-Timeout deadline passes.
     """
+    return await run_cancellable(request, build_structured_study_guide_pdf(data, title, user))
+
+async def build_structured_study_guide_pdf(data: GenerateStructuredGuideRequest, title: str, user):
     # 1. Orchestrate the structure (topics + quizzes)
-    topics_with_quiz = await generate_structured_study_guide(data, user)
+    topics_with_quiz = await get_or_build_structured_study_guide(data, user)
     # 2. Build the HTML
     html_content = build_structured_study_guide_html(topics_with_quiz, title)
-    # 3. Generate the PDF
+    # 3. Generate the PDF (in a worker thread, so disconnects are still noticed)
     pdf_io = io.BytesIO()
-    HTML(string=html_content).write_pdf(pdf_io)
+    await asyncio.to_thread(HTML(string=html_content).write_pdf, pdf_io)
     pdf_io.seek(0)
     # 4. Return the PDF as a downloadable file
     return StreamingResponse(pdf_io, media_type="application/pdf", headers={
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import List
-from utils import verify_token, client
+from utils import verify_token, client, openai_slot
+from textprep import prepare_transcript
+from speculative import get_precomputed
 import datetime
 import json
 import re
@@ -24,26 +26,36 @@ class StudyPlanResponse(BaseModel):
 async def generate_studyplan(req: StudyPlanRequest, user=Depends(verify_token)):
     if not req.text or len(req.text.strip()) == 0:
         raise HTTPException(status_code=400, detail="Text content is required")
+    # Served instantly if generated in the background after /transcribe?precompute=true
+    precomputed = await get_precomputed("studyplan", req.text, num_reviews=req.num_reviews)
+    if precomputed is not None:
+        return precomputed
+    return await create_studyplan(req)
 
+async def create_studyplan(req: StudyPlanRequest) -> dict:
+    """
+    Generates the study plan with GPT (used by the endpoint and by speculative precomputation).
+    """
     # Prompt para o modelo gerar o plano de estudos
     prompt = (
         "Aja como um assistente educacional. A partir do texto abaixo, identifique os principais tópicos e gere um plano de estudos personalizado. "
         "Para cada tópico, sugira {num_reviews} datas de revisão usando a técnica de spaced repetition (ex: 1, 3, 7 dias após o estudo inicial). "
         "Inclua uma breve nota ou dica para cada tópico. Responda SOMENTE com um JSON no formato:\n"
         "{\n  'plan': [\n    { 'topic': '...', 'review_dates': ['2024-06-22', ...], 'notes': '...' }, ...\n  ]\n}\n"
-        f"Texto:\n{req.text}\n"
+        f"Texto:\n{await prepare_transcript(req.text)}\n"
     ).replace("{num_reviews}", str(req.num_reviews))
 
     try:
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Você é um assistente que cria planos de estudo personalizados a partir de textos."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=1500,
-            temperature=0.7,
-        )
+        async with openai_slot():
+            response = await client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "Você é um assistente que cria planos de estudo personalizados a partir de textos."},
+                    {"role": "user", "content": prompt},
+                ],
+                max_tokens=1500,
+                temperature=0.7,
+            )
         content = response.choices[0].message.content
         if not content or len(content.strip()) == 0:
             raise HTTPException(status_code=500, detail="Model returned empty response")
@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import Counter
+from state import get_state
+
+# =============================
+# Transcript pre-processing
+# =============================
+# Raw Whisper output carries filler words, false starts and repeated phrases.
+# Everything here is plain regex/list work so it runs locally in milliseconds,
+# before the transcript is pasted into any GPT prompt.
+
+# Set to "false" to send transcripts to the LLM untouched
+TRANSCRIPT_NORMALIZATION = os.getenv("TRANSCRIPT_NORMALIZATION", "true").lower() == "true"
+# Max prompt tokens for a transcript (0 disables extractive sentence selection)
+TRANSCRIPT_TOKEN_BUDGET = int(os.getenv("TRANSCRIPT_TOKEN_BUDGET", "0"))
+# How long prepared transcripts stay in the shared state cache (seconds)
+TRANSCRIPT_CACHE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL", "3600"))
+
+# Filler words and verbal tics (English and Portuguese). Kept conservative on
+# purpose: "um" is not removed because it is a real word in Portuguese.
+_FILLER_PATTERNS = [
+    re.compile(r"\b(?:uh+|uhm+|umm+|erm+|hmm+|mhm+|ahn+|hã+|éh+)\b[,.]?\s*", re.IGNORECASE),
+    re.compile(r",\s*(?:you know|I mean|né|sabe|tipo assim)(?=\s*[,.?!])", re.IGNORECASE),
+    re.compile(r"(?:(?<=^)|(?<=[.?!]\s))(?:(?:so|well|okay|ok|I mean|you know|então|bom|tipo)\s*,\s*)+", re.IGNORECASE),
+]
+# False starts such as "we wen- went" or "o pro- processo": only a fragment the next
+# word starts with is dropped, so "ex- presidente" or "pre- and post-war" are kept
+_FALSE_START = re.compile(r"\b(?!\w*\d)(\w+)-\s+(?=\1)", re.IGNORECASE)
+# Whitespace and punctuation left behind by the removals above
+_MULTI_SPACE = re.compile(r"[ \t]+")
+_SPACE_BEFORE_PUNCT = re.compile(r"\s+([,.?!;:])")
+_REPEATED_PUNCT = re.compile(r"([,.?!;:])(?:\s*[,;:])+")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.?!])\s+")
+_WORD = re.compile(r"\w+")
+
+# Longest phrase (in words) checked for immediate repetition
+_MAX_NGRAM = 6
+# A single word is only collapsed when repeated this many times in a row ("the the the"),
+# so legitimate doubles like "that that" or "had had" survive
+_MIN_WORD_REPEATS = 3
+# Long unpunctuated stretches are split into pieces of this many words for selection
+_MAX_SENTENCE_WORDS = 60
+
+# Tokenizer is loaded lazily (tiktoken may need to fetch its BPE file)
+_tokenizer_cache = {}
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts tokens the way the OpenAI models do, using tiktoken when available.
+    Falls back to the usual ~4 characters per token estimate otherwise.
+    """
+    if "encoding" not in _tokenizer_cache:
+        try:
+            import tiktoken
+            _tokenizer_cache["encoding"] = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        except Exception as e:
+            print(f"tiktoken unavailable, using approximate token count: {e}")
+            _tokenizer_cache["encoding"] = None
+    encoding = _tokenizer_cache["encoding"]
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Longest prefix of the text (cut at a word boundary) that fits in max_tokens.
+    """
+    encoding = _tokenizer_cache.get("encoding")
+    if encoding is not None:
+        prefix = encoding.decode(encoding.encode(text)[:max_tokens])
+    else:
+        prefix = text[:max_tokens * 4]
+    if len(prefix) < len(text) and " " in prefix:
+        prefix = prefix.rsplit(" ", 1)[0]
+    return prefix.strip()
+
+
+def _normalize_word(word: str) -> str:
+    return word.strip(".,?!;:\"'").lower()
+
+
+def _carry_punctuation(kept: str, dropped: str) -> str:
+    """
+    Punctuation of a dropped copy replaces the kept copy's own trailing ,;: so
+    "New York, New York is" becomes "New York is" and "then, then." becomes "then.".
+    """
+    kept = kept.rstrip(",;:")
+    if dropped[-1:] in ".?!,;:" and kept[-1:] not in ".?!":
+        kept += dropped[-1]
+    return kept
+
+
+def collapse_repetitions(text: str, max_ngram: int = _MAX_NGRAM) -> str:
+    """
+    Collapses phrases repeated back to back ("the the the", "I think that I think that").
+    Compares words case-insensitively and ignoring punctuation, keeps the first occurrence.
+    Single words need _MIN_WORD_REPEATS copies; phrases with numbers are never collapsed.
+    """
+    words = text.split()
+    keys = [_normalize_word(w) for w in words]
+    out_words = []
+    out_keys = []
+    # Index of the first word of the current sentence; repeats never span sentences
+    sentence_start = 0
+    # Word whose stutter was just collapsed: further copies are dropped as they come
+    stutter = None
+    for word, key in zip(words, keys):
+        if stutter is not None and key == stutter and len(out_keys) > sentence_start:
+            out_words[-1] = _carry_punctuation(out_words[-1], word)
+            if word[-1:] in ".?!":
+                sentence_start = len(out_words)
+            continue
+        stutter = None
+        out_words.append(word)
+        out_keys.append(key)
+        # After each word, drop the tail if it repeats the n-gram right before it
+        for n in range(1, max_ngram + 1):
+            copies = _MIN_WORD_REPEATS if n == 1 else 2
+            if len(out_keys) - sentence_start < copies * n:
+                if n == 1:
+                    continue
+                break
+            tail = out_keys[-n:]
+            if not all(tail) or any(ch.isdigit() for k in tail for ch in k):
+                continue
+            if all(out_keys[-(i + 1) * n:len(out_keys) - i * n] == tail for i in range(1, copies)):
+                # Keep the punctuation of the last copy (e.g. a sentence-ending period)
+                del out_words[-(copies - 1) * n:]
+                del out_keys[-(copies - 1) * n:]
+                out_words[-1] = _carry_punctuation(out_words[-1], word)
+                if n == 1:
+                    stutter = key
+                break
+        if word[-1:] in ".?!":
+            sentence_start = len(out_words)
+    return " ".join(out_words)
+
+
+def normalize_transcript(text: str) -> str:
+    """
+    Removes filler words and false starts, collapses repeated phrases and tidies
+    whitespace/punctuation. Does not summarize or drop any sentence.
+    """
+    for pattern in _FILLER_PATTERNS:
+        text = pattern.sub("", text)
+    text = _FALSE_START.sub("", text)
+    text = collapse_repetitions(text)
+    text = _MULTI_SPACE.sub(" ", text)
+    text = _SPACE_BEFORE_PUNCT.sub(r"\1", text)
+    text = _REPEATED_PUNCT.sub(r"\1", text)
+    # Re-capitalize sentences whose first word was a removed filler
+    text = re.sub(r"(^|[.?!]\s+)([a-zà-ú])", lambda m: m.group(1) + m.group(2).upper(), text)
+    return text.strip()
+
+
+def select_sentences(text: str, max_tokens: int) -> str:
+    """
+    Extractive selection: keeps the most informative sentences (by word frequency)
+    in their original order until the token budget is reached.
+    Never returns an empty string for a non-empty text: if no sentence fits, the
+    text is truncated to the budget instead.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    sentences = []
+    for sentence in _SENTENCE_SPLIT.split(text):
+        # Transcripts often lack punctuation: split run-on sentences into word windows
+        words = sentence.split()
+        for start in range(0, len(words), _MAX_SENTENCE_WORDS):
+            sentences.append(" ".join(words[start:start + _MAX_SENTENCE_WORDS]))
+    frequencies = Counter(
+        w.lower() for w in _WORD.findall(text) if len(w) > 3
+    )
+    scored = []
+    for idx, sentence in enumerate(sentences):
+        words = [w.lower() for w in _WORD.findall(sentence) if len(w) > 3]
+        score = sum(frequencies[w] for w in words) / (len(words) or 1)
+        scored.append((score, idx, sentence))
+    scored.sort(key=lambda s: (-s[0], s[1]))
+
+    selected = []
+    used_tokens = 0
+    for score, idx, sentence in scored:
+        sentence_tokens = count_tokens(sentence) + 1
+        if used_tokens + sentence_tokens > max_tokens:
+            continue
+        selected.append((idx, sentence))
+        used_tokens += sentence_tokens
+    if not selected:
+        return truncate_to_tokens(text, max_tokens)
+    selected.sort()
+    return " ".join(sentence for _, sentence in selected)
+
+
+async def prepare_transcript(text: str, max_tokens: int = None) -> str:
+    """
+    Normalizes a transcript before it is pasted into an LLM prompt and, when a token
+    budget is set, trims it with extractive sentence selection.
+    max_tokens defaults to TRANSCRIPT_TOKEN_BUDGET; pass 0 to never drop sentences.
+    Results are cached per transcript in the state backend, so repeated calls for the
+    same text are free on every worker.
+    """
+    if not TRANSCRIPT_NORMALIZATION or not text:
+        return text
+    if max_tokens is None:
+        max_tokens = TRANSCRIPT_TOKEN_BUDGET
+    key = "transcript_prep:" + hashlib.sha256(f"{max_tokens}:{text}".encode("utf-8")).hexdigest()
+    cached = await get_state().get(key)
+    if cached is not None:
+        return cached
+
+    # Regex and tokenizer work takes ~0.2s on long transcripts: keep it off the event loop
+    prepared = await asyncio.to_thread(_prepare_transcript, text, max_tokens)
+    await get_state().set(key, prepared, ttl=TRANSCRIPT_CACHE_TTL)
+    return prepared
+
+
+def _prepare_transcript(text: str, max_tokens: int) -> str:
+    """
+    Uncached, blocking part of prepare_transcript (run it in a worker thread).
+    """
+    start = time.perf_counter()
+    prepared = normalize_transcript(text)
+    if max_tokens:
+        prepared = select_sentences(prepared, max_tokens)
+    elapsed = time.perf_counter() - start
+
+    tokens_before = count_tokens(text)
+    tokens_after = count_tokens(prepared)
+    saved = 100 * (tokens_before - tokens_after) / tokens_before if tokens_before else 0
+    print(f"[PERF] Transcript prep: {tokens_before} -> {tokens_after} tokens (-{saved:.1f}%) in {elapsed:.3f} seconds.")
+    return prepared
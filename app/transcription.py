@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import functools
+import importlib.util
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from utils import client, openai_slot
+from cancellation import check_cancelled, cancellable_lock, timeout_kwargs
+
+# =============================
+# Transcription backends
+# =============================
+# /transcribe picks one of these through ?provider=:
+#   openai          -> OpenAI Whisper API (needs OPENAI_API_KEY)
+#   faster-whisper  -> CTranslate2 int8 model on CPU (self-hosted, several times faster)
+#   anything else   -> local openai-whisper PyTorch model (previous default)
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Model size for the local backends ("tiny", "base", "small", ...)
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "base")
+FASTER_WHISPER_MODEL = os.getenv("FASTER_WHISPER_MODEL", LOCAL_WHISPER_MODEL)
+# CTranslate2 quantization and CPU threads. 0 lets CTranslate2 decide (4 threads);
+# os.cpu_count() would report the host's cores inside containers, not the CPU quota
+FASTER_WHISPER_COMPUTE_TYPE = os.getenv("FASTER_WHISPER_COMPUTE_TYPE", "int8")
+FASTER_WHISPER_CPU_THREADS = int(os.getenv("FASTER_WHISPER_CPU_THREADS", "0"))
+# 1 = greedy decoding, same as openai-whisper's model.transcribe default
+FASTER_WHISPER_BEAM_SIZE = int(os.getenv("FASTER_WHISPER_BEAM_SIZE", "1"))
+TRANSCRIPTION_LANGUAGE = os.getenv("TRANSCRIPTION_LANGUAGE", "en")
+# Threads for local inference (Whisper, faster-whisper, T5). A dedicated pool, so jobs
+# waiting for a model can't use up the default executor (spaCy, PDF rendering)
+LOCAL_INFERENCE_THREADS = int(os.getenv("LOCAL_INFERENCE_THREADS", "4"))
+
+local_inference_executor = ThreadPoolExecutor(max_workers=LOCAL_INFERENCE_THREADS, thread_name_prefix="local-inference")
+
+
+async def run_local_inference(func, *args):
+    """
+    asyncio.to_thread on local_inference_executor: the context (request cancel
+    scope) is copied, so check_cancelled() works inside func.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        local_inference_executor, functools.partial(context.run, func, *args)
+    )
+
+
+class TranscriptionBackend:
+    """
+    Base class: turns an audio file into text. Models are loaded lazily and kept
+    for the lifetime of the process. transcribe() runs in a worker thread, one job at
+    a time per model, and should call check_cancelled() between chunks of work; API
+    backends override transcribe_async() instead, so cancelling the request aborts
+    the HTTP call.
+    """
+    name = "base"
+    # Whether transcribe() also takes 16kHz float32 PCM samples instead of a file path
+    accepts_pcm = False
+    # Max file size the backend accepts (None = no limit)
+    max_upload_bytes = None
+
+    def __init__(self):
+        # Guard the lazy model load and serialize inference on the model
+        self._load_lock = threading.Lock()
+        self._inference_lock = threading.Lock()
+
+    def load(self):
+        """Loads the model if the backend has one (no-op by default)."""
+
+    def transcribe(self, audio) -> str:
+        raise NotImplementedError
+
+    async def transcribe_async(self, audio, track=None) -> str:
+        """
+        Entry point used by /transcribe: runs transcribe() on the local inference pool.
+        track is an optional callable returning the routing stats context manager; it is
+        entered inside the thread, so the job counts as in flight until the model is free.
+        """
+        def run():
+            with track() if track else nullcontext() as job:
+                # Parallel runs would only fight over the same CPU cores
+                with cancellable_lock(self._inference_lock):
+                    if job:
+                        job.start()
+                    return self.transcribe(audio)
+
+        return await run_local_inference(run)
+
+
+class OpenAIWhisperBackend(TranscriptionBackend):
+    """
+    Sends the audio file to the OpenAI Whisper API (25MB upload limit).
+    """
+    name = "openai"
+    max_upload_bytes = 25 * 1024 * 1024
+
+    async def transcribe_async(self, audio_path: str, track=None) -> str:
+        check_cancelled()
+        with open(audio_path, "rb") as audio_file:
+            with track() if track else nullcontext() as job:
+                async with openai_slot():
+                    if job:
+                        job.start()
+                    response = await client.audio.transcriptions.create(
+                        model="whisper-1",
+                        file=audio_file,
+                        **timeout_kwargs(),  # Respect the request deadline, if any
+                    )
+            return response.text
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """
+    openai-whisper PyTorch model (float32 on CPU).
+    """
+    name = "local"
+    accepts_pcm = True
+
+    def __init__(self, model_size: str = LOCAL_WHISPER_MODEL):
+        super().__init__()
+        self.model_size = model_size
+        self.model = None
+
+    def load(self):
+        if self.model is None:
+            # Concurrent first requests wait for a single load instead of each loading a copy
+            with self._load_lock:
+                if self.model is None:
+                    import whisper
+                    self.model = whisper.load_model(self.model_size)
+        return self.model
+
+    def transcribe(self, audio) -> str:
+        import whisper
+        # Whisper's own seek loop handles long audio (30s windows with context carried
+        # over); the wrapper only adds a cancellation check before each window
+        result = whisper.transcribe(_CancellableModel(self.load()), audio, language=TRANSCRIPTION_LANGUAGE)
+        return result["text"].strip()
+
+
+class _CancellableModel:
+    """
+    Proxy of an openai-whisper model that calls check_cancelled() before decoding
+    each 30s window, so a cancelled request stops within one window.
+    """
+
+    def __init__(self, model):
+        self._model = model
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def decode(self, *args, **kwargs):
+        check_cancelled()
+        return self._model.decode(*args, **kwargs)
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """
+    CTranslate2 Whisper (faster-whisper) with int8 weights on CPU.
+    """
+    name = "faster-whisper"
+    accepts_pcm = True
+
+    def __init__(self, model_size: str = FASTER_WHISPER_MODEL, compute_type: str = FASTER_WHISPER_COMPUTE_TYPE,
+                 cpu_threads: int = FASTER_WHISPER_CPU_THREADS):
+        super().__init__()
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.model = None
+
+    def load(self):
+        if self.model is None:
+            with self._load_lock:
+                if self.model is None:
+                    try:
+                        from faster_whisper import WhisperModel
+                    except ImportError:
+                        raise ImportError("faster-whisper is not installed. Please install it with 'pip install faster-whisper'.")
+                    self.model = WhisperModel(
+                        self.model_size,
+                        device="cpu",
+                        compute_type=self.compute_type,
+                        cpu_threads=self.cpu_threads,
+                    )
+        return self.model
+
+    def transcribe(self, audio) -> str:
+        # segments is a generator: decoding happens while iterating
+        segments, info = self.load().transcribe(
+            audio,
+            language=TRANSCRIPTION_LANGUAGE,
+            beam_size=FASTER_WHISPER_BEAM_SIZE,
+        )
+        texts = []
+        for segment in segments:
+            check_cancelled()
+            texts.append(segment.text)
+        return "".join(texts).strip()
+
+
+# One instance per backend and process, so each model is loaded at most once
+transcription_backends = {
+    "openai": OpenAIWhisperBackend(),
+    "local": LocalWhisperBackend(),
+    "faster-whisper": FasterWhisperBackend(),
+}
+
+def available_transcription_backends() -> list:
+    """
+    Names of the backends usable in this deployment (credentials and packages present).
+    """
+    available = []
+    if OPENAI_API_KEY:
+        available.append("openai")
+    if importlib.util.find_spec("faster_whisper"):
+        available.append("faster-whisper")
+    if importlib.util.find_spec("whisper"):
+        available.append("local")
+    return available
+
+def get_transcription_backend(provider: str = None) -> TranscriptionBackend:
+    """
+    Maps the ?provider= query value to a transcription backend.
+    Falls back to the local Whisper model when OpenAI is requested without an API key.
+    """
+    if provider == "openai" and OPENAI_API_KEY:
+        return transcription_backends["openai"]
+    if provider == "faster-whisper":
+        return transcription_backends["faster-whisper"]
+    return transcription_backends["local"]
@@ -1,13 +1,41 @@
 import os
+import contextvars
+from contextlib import asynccontextmanager
 from openai import AsyncOpenAI
 from fastapi import HTTPException, Depends
 from jose import jwt, JWTError
+from state import get_state
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 NEXTAUTH_SECRET = os.getenv("NEXTAUTH_SECRET", "insecure_dev_secret")
+# Max concurrent OpenAI calls across all workers sharing the state backend
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+# Of those, max concurrent calls from background work (speculative precomputation);
+# the rest stay reserved for interactive requests
+BACKGROUND_OPENAI_CONCURRENCY = int(os.getenv("BACKGROUND_OPENAI_CONCURRENCY", "2"))
+
+# Set to True by background workers: their OpenAI calls use the smaller background limit
+background_priority = contextvars.ContextVar("background_priority", default=False)
 
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
+@asynccontextmanager
+async def openai_slot():
+    """
+    Async context manager limiting concurrent OpenAI calls (shared across workers
+    when STATE_BACKEND=redis). Usage: async with openai_slot(): await client...
+    Background calls first take a background slot, so they never hold more than
+    BACKGROUND_OPENAI_CONCURRENCY of the shared slots.
+    """
+    state = get_state()
+    if background_priority.get():
+        async with state.semaphore("openai_background", BACKGROUND_OPENAI_CONCURRENCY):
+            async with state.semaphore("openai", OPENAI_MAX_CONCURRENCY):
+                yield
+    else:
+        async with state.semaphore("openai", OPENAI_MAX_CONCURRENCY):
+            yield
+
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 security = HTTPBearer()
 
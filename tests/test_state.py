@@ -0,0 +1,126 @@
+"""
+Tests for the shared state backends. RedisState and RedisSemaphore run against
+fakeredis (with Lua support for the semaphore's EVAL script).
+
+Run from the repository root:
+    pip install -r requirements-dev.txt
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import fakeredis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from state import InMemoryState, RedisSemaphore, RedisState  # noqa: E402
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def redis_state():
+    return RedisState(redis=fakeredis.aioredis.FakeRedis(decode_responses=True), prefix="test:")
+
+
+def test_redis_state_values_and_counters():
+    async def scenario():
+        state = redis_state()
+        await state.set("key", {"text": "olá", "items": [1, 2]}, ttl=60)
+        assert await state.get("key") == {"text": "olá", "items": [1, 2]}
+        assert await state.redis.ttl("test:key") > 0
+        await state.delete("key")
+        assert await state.get("key") is None
+
+        assert await state.incr("counter", 2, ttl=60) == 2
+        assert await state.incr("counter", 3, ttl=60) == 5
+        assert await state.redis.ttl("test:counter") > 0
+
+    run(scenario())
+
+
+def test_redis_state_queue_is_fifo():
+    async def scenario():
+        state = redis_state()
+        await state.enqueue("jobs", {"id": 1})
+        await state.enqueue("jobs", {"id": 2})
+        assert await state.dequeue("jobs", timeout=1) == {"id": 1}
+        assert await state.dequeue("jobs", timeout=1) == {"id": 2}
+
+    run(scenario())
+
+
+def test_redis_semaphore_limits_concurrent_holders():
+    async def scenario():
+        state = redis_state()
+        active = 0
+        peak = 0
+
+        async def worker():
+            nonlocal active, peak
+            async with state.semaphore("openai", 2):
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.05)
+                active -= 1
+
+        await asyncio.gather(*[worker() for _ in range(6)])
+        assert peak == 2
+        # Every slot was released
+        assert await state.redis.zcard("test:semaphore:openai") == 0
+
+    run(scenario())
+
+
+def test_redis_semaphore_reclaims_expired_leases():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        crashed = RedisSemaphore(redis, "semaphore:test", limit=1, lease_seconds=1)
+        await crashed.acquire()  # Never released, as if the worker died
+        waiting = RedisSemaphore(redis, "semaphore:test", limit=1, lease_seconds=1)
+        await asyncio.wait_for(waiting.acquire(), timeout=3)
+        await waiting.release()
+
+    run(scenario())
+
+
+def test_memory_state_evicts_least_recently_used_keys():
+    async def scenario():
+        state = InMemoryState(max_keys=2)
+        await state.set("a", 1)
+        await state.set("b", 2)
+        assert await state.get("a") == 1  # "b" is now the least recently used
+        await state.set("c", 3)
+        assert await state.get("b") is None
+        assert await state.get("a") == 1
+        assert await state.get("c") == 3
+
+    run(scenario())
+
+
+def test_memory_state_sweeps_expired_keys(monkeypatch):
+    import state as state_module
+    monkeypatch.setattr(state_module, "MEMORY_STATE_SWEEP_INTERVAL", 0)
+
+    async def scenario():
+        state = InMemoryState()
+        await state.set("old", "value", ttl=0.01)
+        await asyncio.sleep(0.02)
+        await state.set("new", "value")
+        # Swept without ever being read again
+        assert "old" not in state._values
+
+    run(scenario())
+
+
+def test_pop_returns_value_once():
+    async def scenario():
+        for state in (InMemoryState(), redis_state()):
+            await state.set("artifact", [1, 2], ttl=60)
+            assert await state.pop("artifact") == [1, 2]
+            assert await state.pop("artifact") is None
+            assert await state.get("artifact") is None
+
+    run(scenario())